@@ -4,42 +4,55 @@ LLM → Cypher → Neo4j（只读、安全、带 /schema、单轮会话上下文
 完整的 Case–Diagnosis–ZhengXing–Prescription–Herb 路径闭环
 """
 
-import os, re, json
-from typing import Any, Dict, List, Optional, Tuple
-from fastapi import FastAPI, HTTPException
+import os, re, hashlib, time
+import orjson
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, List, Optional, Tuple
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+import anyio
 from pydantic import BaseModel
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase, AsyncSession
 
 # ========== 环境 ==========
 NEO4J_URI  = os.getenv("NEO4J_URI",  "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASS = os.getenv("NEO4J_PASS", "test12345")
+# 连接池按单 worker 的并发量配置，可通过环境变量按负载调整
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_ACQ_TIMEOUT = float(os.getenv("NEO4J_ACQ_TIMEOUT", "30"))
 
 neo4j_ready = False
 try:
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASS))
-    with driver.session() as s:
-        s.run("RETURN 1")
-    neo4j_ready = True
-    print(f"✅ Neo4j 连接成功: {NEO4J_URI} 用户={NEO4J_USER}")
+    # 异步驱动：连接检查放到 startup 事件里执行
+    driver = AsyncGraphDatabase.driver(
+        NEO4J_URI,
+        auth=(NEO4J_USER, NEO4J_PASS),
+        max_connection_pool_size=NEO4J_POOL_SIZE,
+        connection_acquisition_timeout=NEO4J_ACQ_TIMEOUT,
+        connection_timeout=10,
+        max_connection_lifetime=3600,
+        keep_alive=True,
+    )
 except Exception as e:
-    print(f"❌ Neo4j 连接失败: {e}")
+    print(f"❌ Neo4j 驱动创建失败: {e}")
 
 # OpenAI
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 except Exception:
-    OpenAI = None
+    AsyncOpenAI = None
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 client = None
 llm_ready = False
-if OpenAI and OPENAI_API_KEY:
+if AsyncOpenAI and OPENAI_API_KEY:
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
         llm_ready = True
         print(f"✅ OpenAI 客户端就绪: 模型={OPENAI_MODEL}")
     except Exception as e:
@@ -47,8 +60,44 @@ if OpenAI and OPENAI_API_KEY:
 else:
     print("❌ OpenAI API Key 未设置或 openai 包未安装")
 
+# 语义缓存（依赖 numpy，可选）
+try:
+    from semantic_cache import SemanticCache
+except Exception:
+    SemanticCache = None
+
+OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+SEM_CACHE = None
+if SemanticCache and client:
+    SEM_CACHE = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD)
+elif client:
+    print("⚠️ numpy 未安装，语义缓存未启用")
+
 # ========== 上下文 ==========
-LAST_CONTEXT: Dict[str, Dict[str, Any]] = {}
+# 按 session_id 做 LRU + TTL，避免长时间运行时无限增长；
+# 每个会话只保留前几行结果作为预览，下一轮 prompt 的长度与结果集大小无关
+_CTX_MAX = 1024
+_CTX_TTL = 1800.0
+_CTX_RESULTS_MAX = 5
+LAST_CONTEXT: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def get_last_context(session_id: str) -> Optional[Dict[str, Any]]:
+    hit = LAST_CONTEXT.get(session_id)
+    if hit is None:
+        return None
+    if time.monotonic() - hit[0] >= _CTX_TTL:
+        del LAST_CONTEXT[session_id]
+        return None
+    LAST_CONTEXT.move_to_end(session_id)
+    return hit[1]
+
+def set_last_context(session_id: str, ctx: Dict[str, Any]) -> None:
+    LAST_CONTEXT[session_id] = (time.monotonic(), ctx)
+    LAST_CONTEXT.move_to_end(session_id)
+    while len(LAST_CONTEXT) > _CTX_MAX:
+        LAST_CONTEXT.popitem(last=False)
 
 # ========== Graph 模式 ==========
 SCHEMA = {
@@ -112,7 +161,10 @@ SCHEMA = {
         "MATCH (c:Case) WHERE c.tongue IS NULL OR size(c.tongue)=0 RETURN c.case_id AS 案例号 ORDER BY c.case_id ASC",
 
         # 证型为空
-        "MATCH (c:Case) WHERE c.zhengxing IS NULL OR size(c.zhengxing)=0 RETURN c.case_id AS 案例号 ORDER BY c.case_id ASC"
+        "MATCH (c:Case) WHERE c.zhengxing IS NULL OR size(c.zhengxing)=0 RETURN c.case_id AS 案例号 ORDER BY c.case_id ASC",
+
+        # 原文关键词（全文索引 case_text_ft，cjk 分词；关键词加双引号做短语查询，避免按单字匹配）
+        "CALL db.index.fulltext.queryNodes('case_text_ft', '\"盗汗\"') YIELD node AS c RETURN c.case_id AS 案例号, c.original_text AS 原始文献"
     ]
 }
 
@@ -135,8 +187,26 @@ RECOMMENDED_QUERIES = [
     "列出系统中证型为空的案例号"
 ]
 
+# RECOMMENDED_QUERIES 与 SCHEMA["examples"] 的顺序并不一一对应，这里显式列出能对上的下标
+_RECOMMENDED_EXAMPLE_PAIRS = (
+    (0, 0), (1, 1), (2, 2), (3, 3), (5, 5), (7, 7),
+    (9, 8), (10, 9), (11, 6), (13, 13), (14, 14), (15, 15),
+)
+
+def _normalize_query(q: str) -> str:
+    return "".join(q.split())
+
+# 推荐问题直接走手写 Cypher，完全跳过 LLM（key 去掉所有空白，容忍空格/换行差异）
+FAST_PATH: Dict[str, str] = {
+    _normalize_query(RECOMMENDED_QUERIES[i]): SCHEMA["examples"][j] for i, j in _RECOMMENDED_EXAMPLE_PAIRS
+}
+
 # ========== FastAPI ==========
-app = FastAPI(title="LLM → Cypher → Neo4j (Read-Only, Single-Turn Context)", version="1.0.11")
+app = FastAPI(
+    title="LLM → Cypher → Neo4j (Read-Only, Single-Turn Context)",
+    version="1.0.11",
+    default_response_class=ORJSONResponse,
+)
 '''
 app.add_middleware(
     CORSMiddleware,
@@ -161,6 +231,7 @@ app.add_middleware(
 class CypherResponse(BaseModel):
     query: str
     cypher: str
+    params: Dict[str, Any] = {}
     results: List[Dict[str, Any]] = []
     note: Optional[str] = None
     session_id: Optional[str] = None
@@ -168,110 +239,193 @@ class CypherResponse(BaseModel):
     answer: Optional[str] = None
     answer_format: Optional[str] = None
 
+def cypher_response(query: str, cypher: str, params: Dict[str, Any], **fields: Any) -> ORJSONResponse:
+    """与 CypherResponse 同形状的响应体，直接序列化，跳过 Pydantic 对每一行结果的校验"""
+    body = {
+        "query": query, "cypher": cypher, "params": params, "results": [], "note": None,
+        "session_id": None, "used_prev_context": False, "answer": None, "answer_format": None,
+    }
+    body.update(fields)
+    return ORJSONResponse(body)
+
 # ========== 校验 ==========
-READ_ONLY_OK = re.compile(
-    r"^\s*(CALL|MATCH|OPTIONAL\s+MATCH|WITH|UNWIND|RETURN|WHERE|ORDER\s+BY|LIMIT|SKIP|PROFILE|EXPLAIN|UNION)\b",
-    re.IGNORECASE
+# 整段一次扫描：找第一个不以只读关键字开头的非空行（[^\S\n]* 不跨行，(?=\S) 保证不会回溯到行首空白中间）
+_BAD_LINE = re.compile(
+    r"^[^\S\n]*(?=\S)(?!(?:CALL|MATCH|OPTIONAL\s+MATCH|WITH|UNWIND|RETURN|WHERE|ORDER\s+BY|LIMIT|SKIP|PROFILE|EXPLAIN|UNION)\b)",
+    re.IGNORECASE | re.MULTILINE
 )
 MUTATING_BAD = re.compile(
-    r"\b(CREATE|MERGE|SET|DELETE|DETACH\s+DELETE|REMOVE|DROP|LOAD\s+CSV|APOC\.|CALL\s+dbms|CALL\s+db\.index\.|CALL\s+db\.)\b",
+    r"\b(CREATE|MERGE|SET|DELETE|DETACH\s+DELETE|REMOVE|DROP|LOAD\s+CSV|APOC\.|CALL\s+dbms|CALL\s+db\.(?!index\.fulltext\.queryNodes\b))\b",
     re.IGNORECASE
 )
 
+# 先做集合查表：危险关键字出现即拒绝；每行首 token 都是明确的只读关键字即通过。
+# CALL / OPTIONAL / ORDER 需要看后面的 token，或首 token 不是单独关键字（如 "MATCH(n)"）时回退到上面的正则
+ALLOWED_FIRST = frozenset({"CALL", "MATCH", "OPTIONAL", "WITH", "UNWIND", "RETURN", "WHERE", "ORDER", "LIMIT", "SKIP", "PROFILE", "EXPLAIN", "UNION"})
+BANNED_TOKENS = frozenset({"CREATE", "MERGE", "SET", "DELETE", "DETACH", "REMOVE", "DROP", "LOAD", "APOC"})
+_FAST_FIRST = ALLOWED_FIRST - {"CALL", "OPTIONAL", "ORDER"}
+_RE_WORD = re.compile(r"\w+")
+_RE_LINE_HEAD = re.compile(r"^[^\S\n]*(\S+)", re.MULTILINE)
+
+# ========== 正则（模块级预编译） ==========
+_RE_ZX_CASE = re.compile(r"证型为(.+?)的案例中")
+_RE_FANGJI = re.compile(r"药方为(.+?)的案例中")
+_RE_DISEASE = re.compile(r"疾病为(.+?)的案例中")
+_RE_HERB = re.compile(r"中药\s*([^\s,，。的]+)")
+_RE_HERB_TAIL = re.compile(r"(的)?(剂量|炮制|方法|和|及).*")
+_RE_FANGJI_KW = re.compile(r"(药方|处方)")
+_RE_UNWIND_WHERE = re.compile(r"UNWIND\s+([\w\.\[\]]+)\s+AS\s+(\w+)\s+WHERE\s+", re.I)
+_RE_WHITESPACE = re.compile(r"\s+")
+_RE_CASE_LABEL = re.compile(r"\(c\s*:\s*Case\)", re.I)
+_RE_FENCE_OPEN = re.compile(r"^```(?:cypher)?", re.I)
+_RE_FENCE_CLOSE = re.compile(r"```$")
+
 def is_safe_cypher(cypher: str) -> bool:
-    if MUTATING_BAD.search(cypher):
+    upper = cypher.upper()
+    words = set(_RE_WORD.findall(upper))
+    if not words or words & BANNED_TOKENS:
         return False
-    for line in [l.strip() for l in cypher.splitlines() if l.strip()]:
-        if not READ_ONLY_OK.match(line):
-            return False
-    return True
-
-def run_cypher(cypher: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
-    with driver.session() as s:
-        return [dict(r) for r in s.run(cypher, params or {})]
+    if "CALL" not in words and set(_RE_LINE_HEAD.findall(upper)) <= _FAST_FIRST:
+        return True
+    return not MUTATING_BAD.search(cypher) and not _BAD_LINE.search(cypher)
+
+# ========== 查询结果缓存（TTL + LRU） ==========
+# 图谱变化很慢，推荐问题多是确定性的聚合；/refresh_kg、/update_json 时整体失效
+CYPHER_CACHE_TTL = 300.0
+CYPHER_CACHE_MAX = 256
+_CYPHER_CACHE: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+
+def _cypher_cache_key(cypher: str, params: Optional[Dict[str, Any]]) -> str:
+    return hashlib.blake2b(
+        cypher.encode() + orjson.dumps(params or {}, option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
+
+# 每个请求一个 session（FastAPI 依赖注入），请求结束自动归还连接；session 在第一次查询时才从连接池取连接
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with driver.session() as s:
+        yield s
+
+async def run_cypher(session: AsyncSession, cypher: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    key = _cypher_cache_key(cypher, params)
+    hit = _CYPHER_CACHE.get(key)
+    if hit and time.monotonic() - hit[0] < CYPHER_CACHE_TTL:
+        _CYPHER_CACHE.move_to_end(key)
+        return hit[1]
+    res = await session.run(cypher, params or {})
+    results = await res.data()
+    _CYPHER_CACHE[key] = (time.monotonic(), results)
+    _CYPHER_CACHE.move_to_end(key)
+    while len(_CYPHER_CACHE) > CYPHER_CACHE_MAX:
+        _CYPHER_CACHE.popitem(last=False)
+    return results
 
 # ========== 格式化 ==========
 def format_answer(query: str, results: List[Dict[str, Any]]) -> Tuple[str, str]:
     if not results:
         return f"没有找到符合条件的结果（问题：{query}）。", "list"
     if "频次" in results[0]:
-        header = "| 项目 | 频次 |\n|------|------|"
-        rows = [f"| {list(r.values())[0]} | {r['频次']} |" for r in results]
-        return f"针对你的问题「{query}」，统计结果如下：\n\n{header}\n" + "\n".join(rows), "table"
-    lines = [f"- {json.dumps(r, ensure_ascii=False)}" for r in results]
-    return f"查询结果共 {len(results)} 条，详情如下：\n" + "\n".join(lines), "list"
+        buf = ["| 项目 | 频次 |\n|------|------|"]
+        append = buf.append
+        for r in results:
+            append(f"| {next(iter(r.values()))} | {r['频次']} |")
+        return f"针对你的问题「{query}」，统计结果如下：\n\n" + "\n".join(buf), "table"
+    dumps = orjson.dumps
+    return f"查询结果共 {len(results)} 条，详情如下：\n" + "\n".join(f"- {dumps(r).decode()}" for r in results), "list"
+
+# ========== 模板 Cypher（参数化，便于 Neo4j 复用查询计划） ==========
+CQL_ZX_TO_PRESCRIPTION = (
+    "MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {name:$zname}) "
+    "MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription) "
+    "RETURN p.formula AS 处方, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
+)
+CQL_ZX_TO_HERB = (
+    "MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {name:$zname}) "
+    "MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription)-[:CONTAINS_HERB]->(h:Herb) "
+    "RETURN h.name AS 中药, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
+)
+CQL_ZX_HERB_DOSE = (
+    "MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {name:$zname}) "
+    "MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription)-[r:CONTAINS_HERB]->(h:Herb {name:$hname}) "
+    "RETURN DISTINCT h.name AS 中药, r.dose AS 剂量, r.prep AS 炮制方法"
+)
+CQL_FANGJI_TO_ZX = (
+    "MATCH (c:Case)-[:HAS_PRESCRIPTION]->(p:Prescription {formula:$formula}) "
+    "MATCH (c)-[:HAS_ZHENGXING]->(z:ZhengXing) "
+    "RETURN z.name AS 证型, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
+)
+CQL_FANGJI_TO_DISEASE = (
+    "MATCH (c:Case)-[:HAS_PRESCRIPTION]->(p:Prescription {formula:$formula}) "
+    "MATCH (c)-[:HAS_DIAGNOSIS]->(d:Diagnosis) "
+    "RETURN d.name AS 疾病, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
+)
+CQL_FANGJI_TO_HERB = (
+    "MATCH (c:Case)-[:HAS_PRESCRIPTION]->(p:Prescription {formula:$formula})-[:CONTAINS_HERB]->(h:Herb) "
+    "RETURN h.name AS 中药, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
+)
+CQL_DISEASE_TO_HERB = (
+    "MATCH (c:Case)-[:HAS_DIAGNOSIS]->(d:Diagnosis {name:$dname}) "
+    "MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription)-[:CONTAINS_HERB]->(h:Herb) "
+    "RETURN h.name AS 中药, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
+)
+CQL_DISEASE_TO_ZX = (
+    "MATCH (c:Case)-[:HAS_DIAGNOSIS]->(d:Diagnosis {name:$dname}) "
+    "MATCH (c)-[:HAS_ZHENGXING]->(z:ZhengXing) "
+    "RETURN z.name AS 证型, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
+)
 
 # ========== 自动修正函数 ==========
-def auto_fix_cypher(cql: str) -> str:
+def auto_fix_cypher(cql: str) -> Tuple[str, Dict[str, Any]]:
     """
     ✅ 最终稳定版：
     - 对 '证型为X的案例中' / '药方为X的案例中' 直接返回模板
     - 保留 UNWIND 修复逻辑
     - 所有模板都在 return fixed 之前执行
+    - 返回 (cypher, params)，模板中的名称一律走参数
     """
-    import re
     fixed = cql.strip()
 
     # === ① 修复 UNWIND ... WHERE ===
     def _fix_unwind_where(m):
         expr, var = m.group(1), m.group(2)
-        with_prefix = "c, " if re.search(r"\(c\s*:\s*Case\)", fixed, flags=re.IGNORECASE) else ""
+        with_prefix = "c, " if _RE_CASE_LABEL.search(fixed) else ""
         return f"UNWIND {expr} AS {var} WITH {with_prefix}{var} WHERE "
-    fixed = re.sub(
-        r"UNWIND\s+([\w\.\[\]]+)\s+AS\s+(\w+)\s+WHERE\s+",
-        _fix_unwind_where,
-        fixed,
-        flags=re.IGNORECASE
-    )
+    fixed = _RE_UNWIND_WHERE.sub(_fix_unwind_where, fixed)
 
     # === ② 特殊匹配：证型为 X 的案例中 ===
-    m = re.search(r"证型为(.+?)的案例中", cql)
+    m = _RE_ZX_CASE.search(cql)
     if m:
         zname = m.group(1).strip().replace("'", "").replace("”", "").replace("“", "")
         # 判断问的是哪类对象
-        if re.search(r"(药方|处方)", cql):
-            return (
-                f"MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {{name:'{zname}'}}) "
-                f"MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription) "
-                f"RETURN p.formula AS 处方, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-            )
-        if re.search(r"中药", cql):
-            return (
-                f"MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {{name:'{zname}'}}) "
-                f"MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription)-[:CONTAINS_HERB]->(h:Herb) "
-                f"RETURN h.name AS 中药, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-            )
+        if _RE_FANGJI_KW.search(cql):
+            return CQL_ZX_TO_PRESCRIPTION, {"zname": zname}
+        if "中药" in cql:
+            return CQL_ZX_TO_HERB, {"zname": zname}
 
     # === ✅ 新增覆盖：药方为 X 的案例中 ===
-    m = re.search(r"药方为(.+?)的案例中", cql)
+    m = _RE_FANGJI.search(cql)
     if m:
         formula = m.group(1).strip().replace("'", "").replace("”", "").replace("“", "")
-        return (
-            f"MATCH (c:Case)-[:HAS_PRESCRIPTION]->(p:Prescription {{formula:'{formula}'}}) "
-            f"MATCH (c)-[:HAS_ZHENGXING]->(z:ZhengXing) "
-            f"RETURN z.name AS 证型, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-        )
+        return CQL_FANGJI_TO_ZX, {"formula": formula}
 
     # === ③ 兜底：去除多余换行、空格 ===
-    fixed = re.sub(r"\s+", " ", fixed)
-    return fixed
+    fixed = _RE_WHITESPACE.sub(" ", fixed)
+    return fixed, {}
 
 
 
 # ========== Prompt ==========
 FOLLOWUP_HINTS = ("基于以上", "在此基础上", "继续", "接着", "刚才", "上一个", "上述", "前面的")
 
-def build_system_prompt(prev_ctx: Optional[Dict[str, Any]] = None) -> str:
-    schema_lines = ["图模型："]
-    for n, meta in SCHEMA["nodes"].items():
-        schema_lines.append(f"- (:{n}) props={meta['props']}")
-    schema_lines.append("关系：")
-    for r in SCHEMA["rels"]:
-        schema_lines.append(f"- {r}")
-    schema_text = "\n".join(schema_lines)
-    examples = "\n".join([f"- {ex}" for ex in SCHEMA["examples"]])
+# 静态部分在导入时只构建一次：每次请求发送完全相同的前缀，才能命中 OpenAI 的自动 prompt 缓存
+_SCHEMA_TEXT = "\n".join(
+    ["图模型："]
+    + [f"- (:{n}) props={meta['props']}" for n, meta in SCHEMA["nodes"].items()]
+    + ["关系："]
+    + [f"- {r}" for r in SCHEMA["rels"]]
+)
+_EXAMPLES_TEXT = "\n".join(f"- {ex}" for ex in SCHEMA["examples"])
 
-    base = f"""你是一个“只生成 Neo4j Cypher 查询”的助手。所有答案必须来自数据库。
+_BASE_SYSTEM = f"""你是一个“只生成 Neo4j Cypher 查询”的助手。所有答案必须来自数据库。
 
 重要约束：
 - Case.symptoms / Case.tongue / Case.pulse 均为数组，查询时需 UNWIND。
@@ -281,35 +435,253 @@ def build_system_prompt(prev_ctx: Optional[Dict[str, Any]] = None) -> str:
 - 查询“为空”时用 IS NULL / size(...)=0 或 NOT (c)-[:REL]->(:Node)。
 - 返回字段命名必须中文（症状, 舌象, 脉象, 证型, 疾病, 处方, 煎服方法, 炮制方法, 中药, 剂量, 频次, 案例号, 原始文献）。
 
-{schema_text}
+{_SCHEMA_TEXT}
 
 示例：
-{examples}
+{_EXAMPLES_TEXT}
 """
-    if prev_ctx:
-        prev_json = json.dumps(prev_ctx, ensure_ascii=False)
-        base += f"\n【上一轮上下文】：\n{prev_json}\n"
-    return base
 
-def llm_to_cypher(nl_query: str, prev_ctx: Optional[Dict[str, Any]]) -> str:
+_CTX_HEADER = f"【上一轮上下文】（results_preview 只显示前 {_CTX_RESULTS_MAX} 条，共 result_count 条）：\n"
+
+# ========== LLM 结果缓存（LRU，按完整请求哈希，可落盘） ==========
+# temperature=0 时相同的 (model, messages) 输出确定；key 覆盖整个请求，prompt 改动后旧条目自然失效
+LLM_CACHE_MAX = 512
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", os.path.join(os.path.dirname(__file__), ".llm_cache.json"))
+LLM_TEMPERATURE = 0
+_LLM_CACHE: "OrderedDict[str, str]" = OrderedDict()
+
+def build_messages(nl_query: str, prev_ctx: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+    user = f"当前用户问题：{nl_query}\n请直接给出唯一的可执行 Cypher。"
+    # system 只放静态前缀；上一轮上下文作为 user 消息放在末尾，不破坏可缓存的前缀
+    messages = [{"role":"system","content":_BASE_SYSTEM}]
+    if prev_ctx:
+        messages.append({"role":"user","content":_CTX_HEADER + orjson.dumps(prev_ctx).decode()})
+    messages.append({"role":"user","content":user})
+    return messages
+
+def _llm_cache_key(messages: List[Dict[str, str]]) -> str:
+    return hashlib.blake2b(
+        orjson.dumps([OPENAI_MODEL, LLM_TEMPERATURE, messages]), digest_size=16
+    ).hexdigest()
+
+async def llm_to_cypher(nl_query: str, prev_ctx: Optional[Dict[str, Any]]) -> str:
+    messages = build_messages(nl_query, prev_ctx)
+    key = _llm_cache_key(messages)
+    if key in _LLM_CACHE:
+        _LLM_CACHE.move_to_end(key)
+        return _LLM_CACHE[key]
     if not client:
         raise RuntimeError("OpenAI 客户端未配置：请设置 OPENAI_API_KEY")
-    system = build_system_prompt(prev_ctx)
-    user = f"当前用户问题：{nl_query}\n请直接给出唯一的可执行 Cypher。"
-    resp = client.chat.completions.create(
+    resp = await client.chat.completions.create(
         model=OPENAI_MODEL,
-        messages=[{"role":"system","content":system},{"role":"user","content":user}],
-        temperature=0
+        messages=messages,
+        temperature=LLM_TEMPERATURE
     )
+    usage = getattr(resp, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    if usage is not None and details is not None:
+        print(f"📦 prompt_tokens={usage.prompt_tokens} cached_tokens={details.cached_tokens}")
     text = resp.choices[0].message.content.strip()
-    text = re.sub(r"^```(?:cypher)?", "", text, flags=re.IGNORECASE).strip()
-    text = re.sub(r"```$", "", text).strip()
+    text = _RE_FENCE_OPEN.sub("", text).strip()
+    text = _RE_FENCE_CLOSE.sub("", text).strip()
+    _LLM_CACHE[key] = text
+    while len(_LLM_CACHE) > LLM_CACHE_MAX:
+        _LLM_CACHE.popitem(last=False)
     return text
 
+# ========== 语义缓存（同义问法复用 Cypher） ==========
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    resp = await client.embeddings.create(model=OPENAI_EMBED_MODEL, input=texts)
+    return [d.embedding for d in resp.data]
+
+# 问题里的实体/剂量字面值：「X为Y」「中药Y」里的 Y、引号里的内容、带单位的数值
+_RE_Q_VALUE = re.compile(r"(?:为|是)\s*([^\s,，。？?、的]+)")
+_RE_Q_HERB = re.compile(r"中药\s*([^\s,，。？?、的为是]+)")
+_RE_Q_QUOTED = re.compile(r"[\"'“‘「『]([^\"'”’」』]+)[\"'”’」』]")
+_RE_Q_NUMBER = re.compile(r"\d+(?:\.\d+)?\s*[a-zA-Z克钱两]*")
+_RE_CYPHER_LITERAL = re.compile(r"'([^'\\]*)'|\"([^\"\\]*)\"")
+# 问题问的是哪类属性：「都有哪些疾病」与「都有哪些证型」只差一个名词，向量可能很近，必须分开
+_Q_TARGETS = ("症状", "舌象", "脉象", "证型", "疾病", "处方", "中药", "剂量", "炮制", "煎服",
+              "案例号", "原始文献", "频次")
+
+def _query_entities(q: str) -> FrozenSet[str]:
+    """语义缓存的 tag：只有实体/剂量与所问属性都相同的问题之间才允许复用 Cypher"""
+    q = _normalize_query(q)
+    found = set(_RE_Q_VALUE.findall(q)) | set(_RE_Q_QUOTED.findall(q)) | set(_RE_Q_NUMBER.findall(q))
+    found |= {_RE_HERB_TAIL.sub("", h) for h in _RE_Q_HERB.findall(q)}
+    found |= {t for t in _Q_TARGETS if t in q}
+    found.discard("")
+    return frozenset(found)
+
+def _cypher_literals(cypher: str) -> List[str]:
+    return [a or b for a, b in _RE_CYPHER_LITERAL.findall(cypher)]
+
+def _literals_in_query(cypher: str, q: str) -> bool:
+    """兜底：缓存 Cypher 里写死的字符串字面值必须都出现在新问题里"""
+    q = _normalize_query(q)
+    return all(lit in q for lit in _cypher_literals(cypher))
+
+async def generate_cypher(nl_query: str, prev_ctx: Optional[Dict[str, Any]]) -> str:
+    """无上下文的问题先查语义缓存（只在实体相同的条目里比相似度），未命中再调用 LLM 并写回缓存"""
+    if SEM_CACHE is None or prev_ctx or _llm_cache_key(build_messages(nl_query, None)) in _LLM_CACHE:
+        return await llm_to_cypher(nl_query, prev_ctx)
+    try:
+        vec = (await embed_texts([nl_query]))[0]
+    except Exception as e:
+        print(f"⚠️ embedding 失败，跳过语义缓存: {e}")
+        return await llm_to_cypher(nl_query, prev_ctx)
+    tag = _query_entities(nl_query)
+    hit = SEM_CACHE.lookup(vec, tag)
+    if hit is not None and _literals_in_query(hit, nl_query):
+        print("🎯 语义缓存命中:", nl_query)
+        return hit
+    cypher = await llm_to_cypher(nl_query, prev_ctx)
+    SEM_CACHE.add(vec, cypher, tag)
+    return cypher
+
 def looks_like_followup(q: str) -> bool:
     return any(q.strip().startswith(k) for k in FOLLOWUP_HINTS)
 
+# ========== 模板（固定问法 → 确定性 Cypher） ==========
+def _clean_name(m: "re.Match") -> str:
+    return m.group(1).strip().replace("'", "")
+
+# 模板1：证型为X → 药方
+def tpl_zx_to_prescription(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m = _RE_ZX_CASE.search(query)
+    return (CQL_ZX_TO_PRESCRIPTION, {"zname": _clean_name(m)}) if m else None
+
+# 模板2：证型为X → 中药
+def tpl_zx_to_herb(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m = _RE_ZX_CASE.search(query)
+    return (CQL_ZX_TO_HERB, {"zname": _clean_name(m)}) if m else None
+
+# ✅ 模板8：证型为X → 使用中药Y的剂量与炮制方法
+def tpl_zx_herb_dose(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m1 = _RE_ZX_CASE.search(query)
+    m2 = _RE_HERB.search(query)
+    if not (m1 and m2):
+        return None
+    # 清理可能误匹配的词
+    hname = _RE_HERB_TAIL.sub("", m2.group(1).strip())
+    return CQL_ZX_HERB_DOSE, {"zname": _clean_name(m1), "hname": hname}
+
+# 模板3：药方为X → 证型
+def tpl_fangji_to_zx(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m = _RE_FANGJI.search(query)
+    return (CQL_FANGJI_TO_ZX, {"formula": _clean_name(m)}) if m else None
+
+# 模板4：药方为X → 疾病
+def tpl_fangji_to_disease(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m = _RE_FANGJI.search(query)
+    return (CQL_FANGJI_TO_DISEASE, {"formula": _clean_name(m)}) if m else None
+
+# 模板5：药方为X → 中药
+def tpl_fangji_to_herb(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m = _RE_FANGJI.search(query)
+    return (CQL_FANGJI_TO_HERB, {"formula": _clean_name(m)}) if m else None
+
+# 模板6：疾病为X → 中药
+def tpl_disease_to_herb(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m = _RE_DISEASE.search(query)
+    return (CQL_DISEASE_TO_HERB, {"dname": _clean_name(m)}) if m else None
+
+# 模板7：疾病为X → 证型
+def tpl_disease_to_zx(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    m = _RE_DISEASE.search(query)
+    return (CQL_DISEASE_TO_ZX, {"dname": _clean_name(m)}) if m else None
+
+# 问题里的关键词标记：flag → 任一关键词出现即置位
+QUERY_FLAGS: Dict[str, Tuple[str, ...]] = {
+    "zx": ("证型为",),
+    "fangji": ("药方为",),
+    "disease": ("疾病为",),
+    "zx_kw": ("证型",),
+    "fangji_obj": ("药方", "处方"),
+    "herb": ("中药",),
+    "herb_or_drug": ("中药", "药物"),
+    "dose_or_prep": ("剂量", "炮制"),
+    "disease_kw": ("疾病", "病名"),
+}
+
+# 按优先级排列：取第一个所需标记全部命中的模板
+TEMPLATES: Dict[FrozenSet[str], Callable[[str], Optional[Tuple[str, Dict[str, Any]]]]] = {
+    frozenset({"zx", "fangji_obj"}): tpl_zx_to_prescription,
+    frozenset({"zx", "herb", "dose_or_prep"}): tpl_zx_herb_dose,
+    frozenset({"zx", "herb"}): tpl_zx_to_herb,
+    frozenset({"fangji", "zx_kw"}): tpl_fangji_to_zx,
+    frozenset({"fangji", "disease_kw"}): tpl_fangji_to_disease,
+    frozenset({"fangji", "herb_or_drug"}): tpl_fangji_to_herb,
+    frozenset({"disease", "herb"}): tpl_disease_to_herb,
+    frozenset({"disease", "zx_kw"}): tpl_disease_to_zx,
+}
+
+def try_template(query: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    flags = {f for f, kws in QUERY_FLAGS.items() if any(k in query for k in kws)}
+    for need, tpl in TEMPLATES.items():
+        if need <= flags:
+            return tpl(query)
+    return None
+
 # ========== 路由 ==========
+# 同步接口（/get_json 等）和 run_in_threadpool 共用 AnyIO 线程池，默认只有 40 个线程
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "100"))
+
+@app.on_event("startup")
+async def raise_threadpool_limit():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+@app.on_event("startup")
+async def check_neo4j():
+    global neo4j_ready
+    try:
+        await driver.verify_connectivity()
+        neo4j_ready = True
+        print(f"✅ Neo4j 连接成功: {NEO4J_URI} 用户={NEO4J_USER}")
+    except Exception as e:
+        print(f"❌ Neo4j 连接失败: {e}")
+
+# LLM 缓存在重启之间保留：启动时读回，关闭时整体写盘（先写临时文件再替换）
+@app.on_event("startup")
+def load_llm_cache():
+    try:
+        with open(LLM_CACHE_FILE, "rb") as f:
+            _LLM_CACHE.update(orjson.loads(f.read()))
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        print(f"⚠️ LLM 缓存读取失败: {e}")
+        return
+    while len(_LLM_CACHE) > LLM_CACHE_MAX:
+        _LLM_CACHE.popitem(last=False)
+    print(f"✅ 已加载 {len(_LLM_CACHE)} 条 LLM 缓存")
+
+@app.on_event("shutdown")
+def save_llm_cache():
+    tmp = LLM_CACHE_FILE + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(_LLM_CACHE))
+        os.replace(tmp, LLM_CACHE_FILE)
+    except Exception as e:
+        print(f"⚠️ LLM 缓存写盘失败: {e}")
+
+@app.on_event("startup")
+async def seed_semantic_cache():
+    if SEM_CACHE is None:
+        return
+    # 写死了药名/剂量的推荐问题不预置：换一个实体就不能复用
+    pairs = [(i, j) for i, j in _RECOMMENDED_EXAMPLE_PAIRS if not _cypher_literals(SCHEMA["examples"][j])]
+    try:
+        vecs = await embed_texts([RECOMMENDED_QUERIES[i] for i, _ in pairs])
+    except Exception as e:
+        print(f"⚠️ 语义缓存预置失败: {e}")
+        return
+    for (i, j), vec in zip(pairs, vecs):
+        SEM_CACHE.add(vec, SCHEMA["examples"][j], _query_entities(RECOMMENDED_QUERIES[i]), pinned=True)
+    print(f"✅ 语义缓存已预置 {len(SEM_CACHE)} 条")
+
 @app.get("/schema")
 def schema():
     return {
@@ -319,129 +691,46 @@ def schema():
         "recommended_queries": RECOMMENDED_QUERIES
     }
 
-@app.get("/ask", response_model=CypherResponse)
-def ask(query: str, session_id: str = "default", dryrun: bool = False):
+@app.get("/ask", responses={200: {"model": CypherResponse}})
+async def ask(query: str, session_id: str = "default", dryrun: bool = False,
+              session: AsyncSession = Depends(get_session)):
     try:
-        prev_ctx = LAST_CONTEXT.get(session_id) if looks_like_followup(query) else None
-        raw_cypher = llm_to_cypher(query, prev_ctx)
-        import re
-        cypher = None  # 初始化
-
-        # ========== 模板1：证型为X → 药方 ==========
-        if "证型为" in query and ("药方" in query or "处方" in query):
-            m = re.search(r"证型为(.+?)的案例中", query)
-            if m:
-                zname = m.group(1).strip().replace("'", "")
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {{name:'{zname}'}}) "
-                    f"MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription) "
-                    f"RETURN p.formula AS 处方, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-                )
-
-        # ========== 模板2：证型为X → 中药 ==========
-        elif "证型为" in query and "中药" in query and "剂量" not in query and "炮制" not in query:
-            m = re.search(r"证型为(.+?)的案例中", query)
-            if m:
-                zname = m.group(1).strip().replace("'", "")
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {{name:'{zname}'}}) "
-                    f"MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription)-[:CONTAINS_HERB]->(h:Herb) "
-                    f"RETURN h.name AS 中药, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-                )
-
-        # ========== ✅ 模板8：证型为X → 使用中药Y的剂量与炮制方法 ==========
-        elif "证型为" in query and "中药" in query and ("剂量" in query or "炮制" in query):
-            m1 = re.search(r"证型为(.+?)的案例中", query)
-            m2 = re.search(r"中药\s*([^\s,，。的]+)", query)
-            if m1 and m2:
-                zname = m1.group(1).strip().replace("'", "")
-                hname = m2.group(1).strip()
-                # 清理可能误匹配的词
-                hname = re.sub(r"(的)?(剂量|炮制|方法|和|及).*", "", hname)
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_ZHENGXING]->(z:ZhengXing {{name:'{zname}'}}) "
-                    f"MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription)-[r:CONTAINS_HERB]->(h:Herb {{name:'{hname}'}}) "
-                    f"RETURN DISTINCT h.name AS 中药, r.dose AS 剂量, r.prep AS 炮制方法"
-                )
-
-        # ========== 模板3：药方为X → 证型 ==========
-        elif "药方为" in query and "证型" in query:
-            m = re.search(r"药方为(.+?)的案例中", query)
-            if m:
-                formula = m.group(1).strip().replace("'", "")
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_PRESCRIPTION]->(p:Prescription {{formula:'{formula}'}}) "
-                    f"MATCH (c)-[:HAS_ZHENGXING]->(z:ZhengXing) "
-                    f"RETURN z.name AS 证型, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-                )
-
-        # ========== 模板4：药方为X → 疾病 ==========
-        elif "药方为" in query and ("疾病" in query or "病名" in query):
-            m = re.search(r"药方为(.+?)的案例中", query)
-            if m:
-                formula = m.group(1).strip().replace("'", "")
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_PRESCRIPTION]->(p:Prescription {{formula:'{formula}'}}) "
-                    f"MATCH (c)-[:HAS_DIAGNOSIS]->(d:Diagnosis) "
-                    f"RETURN d.name AS 疾病, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-                )
-
-        # ========== 模板5：药方为X → 中药 ==========
-        elif "药方为" in query and ("中药" in query or "药物" in query):
-            m = re.search(r"药方为(.+?)的案例中", query)
-            if m:
-                formula = m.group(1).strip().replace("'", "")
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_PRESCRIPTION]->(p:Prescription {{formula:'{formula}'}})-[:CONTAINS_HERB]->(h:Herb) "
-                    f"RETURN h.name AS 中药, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-                )
-
-        # ========== 模板6：疾病为X → 中药 ==========
-        elif "疾病为" in query and "中药" in query:
-            m = re.search(r"疾病为(.+?)的案例中", query)
-            if m:
-                dname = m.group(1).strip().replace("'", "")
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_DIAGNOSIS]->(d:Diagnosis {{name:'{dname}'}}) "
-                    f"MATCH (c)-[:HAS_PRESCRIPTION]->(p:Prescription)-[:CONTAINS_HERB]->(h:Herb) "
-                    f"RETURN h.name AS 中药, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-                )
-
-        # ========== 模板7：疾病为X → 证型 ==========
-        elif "疾病为" in query and "证型" in query:
-            m = re.search(r"疾病为(.+?)的案例中", query)
-            if m:
-                dname = m.group(1).strip().replace("'", "")
-                cypher = (
-                    f"MATCH (c:Case)-[:HAS_DIAGNOSIS]->(d:Diagnosis {{name:'{dname}'}}) "
-                    f"MATCH (c)-[:HAS_ZHENGXING]->(z:ZhengXing) "
-                    f"RETURN z.name AS 证型, count(DISTINCT c) AS 频次 ORDER BY 频次 DESC"
-                )
-
-        # ========== 默认情况 ==========
-        if cypher is None:
-            cypher = auto_fix_cypher(raw_cypher)
+        # 先走推荐问题 / 固定模板，命中则无需调用 LLM
+        fast = FAST_PATH.get(_normalize_query(query))
+        tpl = (fast, {}) if fast else try_template(query)
+        prev_ctx = None
+        if tpl is not None:
+            cypher, params = tpl
+        else:
+            # ========== 默认情况：LLM 生成 ==========
+            prev_ctx = get_last_context(session_id) if looks_like_followup(query) else None
+            raw_cypher = await generate_cypher(query, prev_ctx)
+            cypher, params = auto_fix_cypher(raw_cypher)
+            print("🧠 原始 LLM 输出:", raw_cypher)
 
         # 调试输出
-        print("🧠 原始 LLM 输出:", raw_cypher)
-        print("✅ 最终执行 Cypher:", cypher)
+        print("✅ 最终执行 Cypher:", cypher, params)
 
-        # 安全检查
-        if not is_safe_cypher(cypher):
+        # 安全检查（模板是可信来源，只检查 LLM 生成的 Cypher）
+        if tpl is None and not is_safe_cypher(cypher):
             raise HTTPException(status_code=400, detail=f"生成的 Cypher 非只读或含有危险操作：\n{cypher}")
 
         if dryrun:
-            return CypherResponse(query=query, cypher=cypher, results=[], note="dryrun=true")
+            return cypher_response(query, cypher, params, note="dryrun=true")
 
         print("🚀 执行最终 Cypher:", cypher)
-        results = run_cypher(cypher)
+        results = await run_cypher(session, cypher, params)
 
-        LAST_CONTEXT[session_id] = {"query": query, "cypher": cypher, "results": results}
+        set_last_context(session_id, {
+            "query": query, "cypher": cypher, "params": params,
+            "results_preview": results[:_CTX_RESULTS_MAX], "result_count": len(results)
+        })
         answer_text, fmt = format_answer(query, results)
 
-        return CypherResponse(
-            query=query,
-            cypher=cypher,
+        return cypher_response(
+            query,
+            cypher,
+            params,
             results=results,
             session_id=session_id,
             used_prev_context=bool(prev_ctx),
@@ -460,6 +749,15 @@ def reset_session(session_id: str = "default"):
     LAST_CONTEXT.pop(session_id, None)
     return {"status": "ok", "message": f"session '{session_id}' 已清空"}
 
+@app.post("/cache/clear")
+def clear_cache():
+    n, m = len(_LLM_CACHE), len(_CYPHER_CACHE)
+    _LLM_CACHE.clear()
+    _CYPHER_CACHE.clear()
+    if SEM_CACHE is not None:
+        SEM_CACHE.clear()
+    return {"status": "ok", "message": f"已清空 {n} 条 LLM 缓存、{m} 条查询结果缓存"}
+
 @app.get("/health")
 def health():
     return {
@@ -496,43 +794,74 @@ def root():
 
 
 # =========================== ✅ 新增功能区 ===========================
-import glob
-
 # === JSON 文件在线编辑功能 ===
 JSON_DIR = os.path.join(os.path.dirname(__file__), "json_data")
 
+def _read_json(path: str) -> Any:
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+def _write_json(path: str, content: Any) -> None:
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(content, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+def _scan_json_files() -> List[str]:
+    # scandir 的 DirEntry 自带文件名和类型，不用 glob 的 fnmatch 和逐个 basename；与 glob 一样跳过隐藏文件
+    with os.scandir(JSON_DIR) as it:
+        return [e.name for e in it if e.name.endswith(".json") and not e.name.startswith(".") and e.is_file()]
+
+# 文件内容按 (path, mtime) 缓存；目录列表缓存 5 秒
+_JSON_CACHE: Dict[str, Tuple[float, Any]] = {}
+_LIST_CACHE_TTL = 5.0
+_list_cache_ts = 0.0
+_list_cache: List[str] = []
+
 @app.get("/list_json_files")
 def list_json_files():
     """列出 json_data/ 目录下的所有 JSON 文件"""
+    global _list_cache_ts, _list_cache
     try:
-        files = [os.path.basename(f) for f in glob.glob(os.path.join(JSON_DIR, "*.json"))]
-        return {"status": "ok", "files": files}
+        now = time.monotonic()
+        if now - _list_cache_ts >= _LIST_CACHE_TTL:
+            _list_cache = _scan_json_files()
+            _list_cache_ts = now
+        return {"status": "ok", "files": _list_cache}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"读取 JSON 文件列表失败：{e}")
 
+# 文件读写（含 stat）放到线程池，不阻塞事件循环；缓存命中时只需一次 stat
 @app.get("/get_json")
-def get_json(filename: str):
+async def get_json(filename: str):
     """读取指定 JSON 文件内容"""
     path = os.path.join(JSON_DIR, filename)
-    if not os.path.exists(path):
+    try:
+        ts = (await run_in_threadpool(os.stat, path)).st_mtime
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"{filename} 不存在")
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        hit = _JSON_CACHE.get(path)
+        if hit and hit[0] == ts:
+            return hit[1]
+        data = await run_in_threadpool(_read_json, path)
+        _JSON_CACHE[path] = (ts, data)
+        return data
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"读取 {filename} 失败：{e}")
 
 @app.put("/update_json")
-def update_json(data: dict):
+async def update_json(data: dict):
     """更新指定 JSON 文件（前端在线编辑保存）"""
+    global _list_cache_ts
     filename = data.get("filename")
     content = data.get("content")
     if not filename:
         raise HTTPException(status_code=400, detail="缺少 filename")
     path = os.path.join(JSON_DIR, filename)
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(content, f, ensure_ascii=False, indent=2)
+        await run_in_threadpool(_write_json, path, content)
+        _JSON_CACHE.pop(path, None)
+        _list_cache_ts = 0.0  # 可能新建了文件
+        _CYPHER_CACHE.clear()
         return {"status": "ok", "message": f"{filename} 已更新"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"写入 {filename} 失败：{e}")
@@ -569,108 +898,77 @@ def reload_frontend():
         "neo4j_ready": neo4j_ready
     }
 
-# =========================== ✅ 新增功能区 ===========================
-import glob
-
-# ========== JSON 文件管理 ==========
-JSON_DIR = os.path.join(os.path.dirname(__file__), "json_data")
-
-@app.get("/list_json_files")
-def list_json_files():
-    return [os.path.basename(f) for f in glob.glob(os.path.join(JSON_DIR, "*.json"))]
-
-@app.get("/get_json")
-def get_json(filename: str):
-    path = os.path.join(JSON_DIR, filename)
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail=f"{filename} 不存在")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-@app.put("/update_json")
-def update_json(data: dict):
-    filename = data.get("filename")
-    content = data.get("content")
-    if not filename:
-        raise HTTPException(status_code=400, detail="缺少 filename")
-    path = os.path.join(JSON_DIR, filename)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(content, f, ensure_ascii=False, indent=2)
-    return {"status": "ok", "message": f"{filename} 已更新"}
-
-
 # ========== refresh_kg 单病例刷新 ==========
-def run(tx, q, p=None): tx.run(q, p or {})
+# 单病例重建只用一条语句、一次往返：先删旧 Case，再整体写回
+# 用 FOREACH 而不是串联 UNWIND：某个列表为空时 UNWIND 会把整行吞掉，后面的实体全部写不进去
+_REFRESH_CASE_CYPHER = """
+OPTIONAL MATCH (old:Case {case_id:$case.case_id})
+DETACH DELETE old
+WITH count(*) AS deleted
+MERGE (c:Case {case_id:$case.case_id})
+SET c.symptoms=$case.symptoms, c.tongue=$case.tongue, c.pulse=$case.pulse, c.original_text=$case.original_text
+FOREACH (d IN $case.diagnosis |
+  MERGE (dn:Diagnosis {name:d})
+  MERGE (c)-[:HAS_DIAGNOSIS]->(dn))
+FOREACH (z IN $case.zhengxing |
+  MERGE (zn:ZhengXing {name:z})
+  MERGE (c)-[:HAS_ZHENGXING]->(zn))
+FOREACH (p IN $case.prescriptions |
+  MERGE (pr:Prescription {case_id:$case.case_id, idx:p.idx})
+  SET pr.formula=p.formula, pr.method=p.method
+  MERGE (c)-[:HAS_PRESCRIPTION]->(pr)
+  FOREACH (h IN p.herbs |
+    MERGE (herb:Herb {name:h.name})
+    ON CREATE SET herb.first_seen = date()
+    MERGE (pr)-[r:CONTAINS_HERB]->(herb)
+    SET r.dose=h.dose, r.prep=h.prep))
+"""
+
+async def _write_case(tx, cid: str, v: Dict[str, Any]):
+    """在同一个事务里重建一个病例：整个病例作为一个 $case 参数，一条语句写完"""
+    case = {
+        "case_id": cid,
+        "symptoms": v.get("symptoms", []),
+        "tongue": v.get("tongue", []),
+        "pulse": v.get("pulse", []),
+        "original_text": v.get("original_text"),
+        "diagnosis": v.get("diagnosis", []),
+        "zhengxing": v.get("zhengxing", []),
+        "prescriptions": [
+            {
+                "idx": i,
+                "formula": p.get("formula") or "（未明示方名/加减方）",
+                "method": p.get("method"),
+                "herbs": [{"name": h.get("name"), "dose": h.get("dose"), "prep": h.get("prep")} for h in p.get("herbs", [])],
+            }
+            for i, p in enumerate(v.get("prescriptions", []))
+        ],
+    }
+    await tx.run(_REFRESH_CASE_CYPHER, {"case": case})
 
 @app.post("/refresh_kg")
-def refresh_kg(payload: dict):
+async def refresh_kg(payload: dict, session: AsyncSession = Depends(get_session)):
     filename = payload.get("filename")
     if not filename:
         raise HTTPException(status_code=400, detail="缺少 filename 参数")
     path = os.path.join(JSON_DIR, filename)
-    if not os.path.exists(path):
+    # async 接口里不能直接做阻塞的文件读取，存在性也由线程池里的读取来判断
+    try:
+        v = await run_in_threadpool(_read_json, path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"文件 {filename} 不存在")
-    with open(path, "r", encoding="utf-8") as f:
-        v = json.load(f)
     cid = v.get("case_id")
     if not cid:
         raise HTTPException(status_code=400, detail="JSON 文件缺少 case_id")
 
-    with driver.session() as s:
-        s.execute_write(run, "MATCH (c:Case {case_id:$cid}) DETACH DELETE c", {"cid": cid})
-        s.execute_write(run, """
-        MERGE (c:Case {case_id:$case_id})
-        SET c.symptoms=$symptoms, c.tongue=$tongue, c.pulse=$pulse, c.original_text=$original_text
-        """, {
-            "case_id": cid,
-            "symptoms": v.get("symptoms", []),
-            "tongue": v.get("tongue", []),
-            "pulse": v.get("pulse", []),
-            "original_text": v.get("original_text")
-        })
-        for d in v.get("diagnosis", []):
-            s.execute_write(run, "MERGE (d:Diagnosis {name:$d}) WITH d MATCH (c:Case {case_id:$cid}) MERGE (c)-[:HAS_DIAGNOSIS]->(d)", {"cid": cid, "d": d})
-        for z in v.get("zhengxing", []):
-            s.execute_write(run, "MERGE (z:ZhengXing {name:$z}) WITH z MATCH (c:Case {case_id:$cid}) MERGE (c)-[:HAS_ZHENGXING]->(z)", {"cid": cid, "z": z})
-        for i, p in enumerate(v.get("prescriptions", [])):
-            s.execute_write(run, """
-            MERGE (pr:Prescription {case_id:$cid, idx:$idx})
-            SET pr.formula=coalesce($formula, "（未明示方名/加减方）"), pr.method=$method
-            WITH pr MATCH (c:Case {case_id:$cid})
-            MERGE (c)-[:HAS_PRESCRIPTION]->(pr)
-            """, {"cid": cid, "idx": i, "formula": p.get("formula"), "method": p.get("method")})
-            for h in p.get("herbs", []):
-                s.execute_write(run, """
-                MERGE (herb:Herb {name:$name})
-                ON CREATE SET herb.first_seen = date()
-                WITH herb MATCH (pr:Prescription {case_id:$cid, idx:$idx})
-                MERGE (pr)-[r:CONTAINS_HERB]->(herb)
-                SET r.dose=$dose, r.prep=$prep
-                """, {"name": h.get("name"), "dose": h.get("dose"), "prep": h.get("prep"), "cid": cid, "idx": i})
+    await session.execute_write(_write_case, cid, v)
+    _CYPHER_CACHE.clear()
     return {"status": "ok", "message": f"✅ 病例 {cid} 已重新导入知识图谱"}
 
 
-
-# ========== 健康检查 ==========
-@app.get("/health")
-def health():
-    return {"status": "ok", "neo4j_ready": neo4j_ready, "llm_ready": llm_ready, "model": OPENAI_MODEL}
-
 @app.on_event("shutdown")
-def close_driver():
-    driver.close()
-    """
-    提供给前端的轻量接口，用于检测后端是否更新。
-    可让前端在热加载或版本更新时自动刷新界面。
-    """
-    import time
-    return {
-        "status": "ok",
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "message": "Frontend reload check OK",
-        "model": OPENAI_MODEL,
-        "neo4j_ready": neo4j_ready
-    }
+async def close_driver():
+    await driver.close()
 
 
 
@@ -6,12 +6,16 @@ LLM → Cypher → Neo4j（安全、上下文支持、GraphRAG 问答）
 ✅ 修正 LLM 输出一致性（temperature=0）
 """
 
-import os, re, json, glob
-from typing import Any, Dict, List, Optional
-from fastapi import FastAPI, HTTPException
+import os, re, json, time, hashlib
+import orjson
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, FrozenSet, List, Optional, Tuple
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from neo4j import GraphDatabase
+from starlette.concurrency import run_in_threadpool
+from neo4j import AsyncGraphDatabase, AsyncSession
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -21,20 +25,22 @@ load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 NEO4J_URI  = os.getenv("NEO4J_URI",  "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASS = os.getenv("NEO4J_PASS", "test12345")
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_ACQ_TIMEOUT = float(os.getenv("NEO4J_ACQ_TIMEOUT", "30"))
 
 # ========== LLM 初始化 ==========
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 except Exception:
-    OpenAI = None
+    AsyncOpenAI = None
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 client, llm_ready = None, False
-if OpenAI and OPENAI_API_KEY:
+if AsyncOpenAI and OPENAI_API_KEY:
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
         llm_ready = True
         print(f"✅ OpenAI 客户端就绪: 模型={OPENAI_MODEL}")
     except Exception as e:
@@ -42,16 +48,35 @@ if OpenAI and OPENAI_API_KEY:
 else:
     print("❌ OpenAI API Key 未设置或 openai 包未安装")
 
+# 语义缓存（依赖 numpy，可选）
+try:
+    from semantic_cache import SemanticCache
+except Exception:
+    SemanticCache = None
+
+OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+SEM_CACHE = None
+if SemanticCache and client:
+    SEM_CACHE = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD)
+elif client:
+    print("⚠️ numpy 未安装，语义缓存未启用")
+
 # ========== Neo4j 初始化 ==========
 neo4j_ready = False
 try:
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASS))
-    with driver.session() as s:
-        s.run("RETURN 1")
-    neo4j_ready = True
-    print(f"✅ Neo4j 连接成功: {NEO4J_URI}")
+    # 异步驱动：连接检查放到 startup 事件里执行
+    driver = AsyncGraphDatabase.driver(
+        NEO4J_URI,
+        auth=(NEO4J_USER, NEO4J_PASS),
+        max_connection_pool_size=NEO4J_POOL_SIZE,
+        connection_acquisition_timeout=NEO4J_ACQ_TIMEOUT,
+        connection_timeout=10,
+        keep_alive=True,
+    )
 except Exception as e:
-    print(f"❌ Neo4j 连接失败: {e}")
+    print(f"❌ Neo4j 驱动创建失败: {e}")
 
 # ========== FastAPI 应用 ==========
 app = FastAPI(title="TCM GraphRAG 智能问答系统", version="3.1.0")
@@ -63,8 +88,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def check_neo4j():
+    global neo4j_ready
+    try:
+        await driver.verify_connectivity()
+        neo4j_ready = True
+        print(f"✅ Neo4j 连接成功: {NEO4J_URI}")
+    except Exception as e:
+        print(f"❌ Neo4j 连接失败: {e}")
+
 # ========== Schema 与上下文 ==========
-LAST_CONTEXT: Dict[str, Dict[str, Any]] = {}
+# 按 session_id 做 LRU + TTL，避免长时间运行时无限增长；
+# 每个会话只保留前几行结果作为预览，下一轮 prompt 的长度与结果集大小无关
+_CTX_MAX = 1024
+_CTX_TTL = 1800.0
+_CTX_RESULTS_MAX = 5
+LAST_CONTEXT: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def get_last_context(session_id: str) -> Optional[Dict[str, Any]]:
+    hit = LAST_CONTEXT.get(session_id)
+    if hit is None:
+        return None
+    if time.monotonic() - hit[0] >= _CTX_TTL:
+        del LAST_CONTEXT[session_id]
+        return None
+    LAST_CONTEXT.move_to_end(session_id)
+    return hit[1]
+
+def set_last_context(session_id: str, ctx: Dict[str, Any]) -> None:
+    LAST_CONTEXT[session_id] = (time.monotonic(), ctx)
+    LAST_CONTEXT.move_to_end(session_id)
+    while len(LAST_CONTEXT) > _CTX_MAX:
+        LAST_CONTEXT.popitem(last=False)
 
 # ========== Graph 模式 ==========
 SCHEMA = {
@@ -128,7 +184,10 @@ SCHEMA = {
         "MATCH (c:Case) WHERE c.tongue IS NULL OR size(c.tongue)=0 RETURN c.case_id AS 案例号 ORDER BY c.case_id ASC",
 
         # 证型为空
-        "MATCH (c:Case) WHERE c.zhengxing IS NULL OR size(c.zhengxing)=0 RETURN c.case_id AS 案例号 ORDER BY c.case_id ASC"
+        "MATCH (c:Case) WHERE c.zhengxing IS NULL OR size(c.zhengxing)=0 RETURN c.case_id AS 案例号 ORDER BY c.case_id ASC",
+
+        # 原文关键词（全文索引 case_text_ft，cjk 分词；关键词加双引号做短语查询，避免按单字匹配）
+        "CALL db.index.fulltext.queryNodes('case_text_ft', '\"盗汗\"') YIELD node AS c RETURN c.case_id AS 案例号, c.original_text AS 原始文献"
     ]
 }
 
@@ -151,39 +210,70 @@ RECOMMENDED_QUERIES = [
     "列出系统中证型为空的案例号"
 ]
 
+# RECOMMENDED_QUERIES 与 SCHEMA["examples"] 的顺序并不一一对应，这里显式列出能对上的下标
+_RECOMMENDED_EXAMPLE_PAIRS = (
+    (0, 0), (1, 1), (2, 2), (3, 3), (5, 5), (7, 7),
+    (9, 8), (10, 9), (11, 6), (13, 13), (14, 14), (15, 15),
+)
+
+def _normalize_query(q: str) -> str:
+    return "".join(q.split())
+
+# 推荐问题直接走手写 Cypher，完全跳过 LLM（key 去掉所有空白，容忍空格/换行差异）
+FAST_PATH: Dict[str, str] = {
+    _normalize_query(RECOMMENDED_QUERIES[i]): SCHEMA["examples"][j] for i, j in _RECOMMENDED_EXAMPLE_PAIRS
+}
+
 
 # ========== Cypher 安全校验 ==========
-READ_ONLY_OK = re.compile(
-    r"^\s*(CALL|MATCH|OPTIONAL\s+MATCH|WITH|UNWIND|RETURN|WHERE|ORDER\s+BY|LIMIT|SKIP|UNION)\b",
-    re.IGNORECASE
+# 整段一次扫描：找第一个不以只读关键字开头的非空行（[^\S\n]* 不跨行，(?=\S) 保证不会回溯到行首空白中间）
+_BAD_LINE = re.compile(
+    r"^[^\S\n]*(?=\S)(?!(?:CALL|MATCH|OPTIONAL\s+MATCH|WITH|UNWIND|RETURN|WHERE|ORDER\s+BY|LIMIT|SKIP|UNION)\b)",
+    re.IGNORECASE | re.MULTILINE
 )
 MUTATING_BAD = re.compile(
-    r"\b(CREATE|MERGE|SET|DELETE|DETACH\s+DELETE|REMOVE|DROP|APOC\.|CALL\s+db\.)\b",
+    r"\b(CREATE|MERGE|SET|DELETE|DETACH\s+DELETE|REMOVE|DROP|APOC\.|CALL\s+db\.(?!index\.fulltext\.queryNodes\b))\b",
     re.IGNORECASE
 )
 
+# 先做集合查表：危险关键字出现即拒绝；每行首 token 都是明确的只读关键字即通过。
+# CALL / OPTIONAL / ORDER 需要看后面的 token，或首 token 不是单独关键字（如 "MATCH(n)"）时回退到上面的正则
+ALLOWED_FIRST = frozenset({"CALL", "MATCH", "OPTIONAL", "WITH", "UNWIND", "RETURN", "WHERE", "ORDER", "LIMIT", "SKIP", "UNION"})
+BANNED_TOKENS = frozenset({"CREATE", "MERGE", "SET", "DELETE", "DETACH", "REMOVE", "DROP", "LOAD", "APOC"})
+_FAST_FIRST = ALLOWED_FIRST - {"CALL", "OPTIONAL", "ORDER"}
+_RE_WORD = re.compile(r"\w+")
+_RE_LINE_HEAD = re.compile(r"^[^\S\n]*(\S+)", re.MULTILINE)
+
 def is_safe_cypher(cypher: str) -> bool:
-    if MUTATING_BAD.search(cypher):
+    upper = cypher.upper()
+    words = set(_RE_WORD.findall(upper))
+    if not words or words & BANNED_TOKENS:
         return False
-    for line in [l.strip() for l in cypher.splitlines() if l.strip()]:
-        if not READ_ONLY_OK.match(line):
-            return False
-    return True
+    if "CALL" not in words and set(_RE_LINE_HEAD.findall(upper)) <= _FAST_FIRST:
+        return True
+    return not MUTATING_BAD.search(cypher) and not _BAD_LINE.search(cypher)
 
-def run_cypher(cypher: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
-    with driver.session() as s:
-        return [dict(r) for r in s.run(cypher, params or {})]
+# 每个请求一个 session（FastAPI 依赖注入），请求结束自动归还连接；session 在第一次查询时才从连接池取连接
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with driver.session() as s:
+        yield s
+
+async def run_cypher(session: AsyncSession, cypher: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    res = await session.run(cypher, params or {})
+    return await res.data()
 
 # ========== Prompt 构建（恢复原版） ==========
-def build_system_prompt(prev_ctx: Optional[Dict[str, Any]] = None) -> str:
-    schema_lines = ["图模型结构如下："]
-    for n, meta in SCHEMA["nodes"].items():
-        schema_lines.append(f"- (:{n}) props={meta['props']}")
-    schema_lines.append("关系：")
-    for r in SCHEMA["rels"]:
-        schema_lines.append(f"- {r}")
-    schema_text = "\n".join(schema_lines)
-    base = f"""你是一个专业的“Neo4j Cypher 查询生成助手”，任务是将自然语言问题转换为严格可执行的 Cypher 查询。
+# SCHEMA 运行期不变，静态部分在导入时只构建一次，保证每次发送的前缀逐字节相同
+_SCHEMA_TEXT = "\n".join(
+    ["图模型结构如下："]
+    + [f"- (:{n}) props={meta['props']}" for n, meta in SCHEMA["nodes"].items()]
+    + ["关系："]
+    + [f"- {r}" for r in SCHEMA["rels"]]
+)
+# 附上完整示例：前缀超过 1024 tokens 才会触发 OpenAI 的自动 prompt 缓存
+_EXAMPLES_TEXT = "\n".join(f"- {ex}" for ex in SCHEMA["examples"])
+
+_BASE_SYSTEM = f"""你是一个专业的“Neo4j Cypher 查询生成助手”，任务是将自然语言问题转换为严格可执行的 Cypher 查询。
 所有答案必须来自数据库，不能凭空编造。
 
 约束：
@@ -195,7 +285,7 @@ def build_system_prompt(prev_ctx: Optional[Dict[str, Any]] = None) -> str:
 - (p)-[r:CONTAINS_HERB]->(h) 上存储剂量 dose 和 炮制方法 prep
 - 字段命名统一为中文（症状, 舌象, 脉象, 证型, 疾病, 处方, 煎服方法, 炮制方法, 中药, 剂量, 案例号）
 
-{schema_text}
+{_SCHEMA_TEXT}
 
 示例：
 问：系统中都有哪些症状？
@@ -206,28 +296,148 @@ def build_system_prompt(prev_ctx: Optional[Dict[str, Any]] = None) -> str:
 
 问：含有中药杏仁的处方？
 → MATCH (p:Prescription)-[:CONTAINS_HERB]->(h:Herb {{name:'杏仁'}}) RETURN DISTINCT p.formula AS 处方名
+
+更多示例：
+{_EXAMPLES_TEXT}
 """
+
+_CTX_HEADER = f"【上一轮上下文】（results_preview 只显示前 {_CTX_RESULTS_MAX} 条，共 result_count 条）:\n"
+
+# ========== LLM 结果缓存（LRU，按完整请求哈希，可落盘） ==========
+# temperature=0 时相同的 (model, messages) 输出确定；key 覆盖整个请求，prompt 改动后旧条目自然失效
+LLM_CACHE_MAX = 512
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", os.path.join(os.path.dirname(__file__), ".llm_cache.json"))
+LLM_TEMPERATURE = 0
+_LLM_CACHE: "OrderedDict[str, str]" = OrderedDict()
+
+def build_messages(nl_query: str, prev_ctx: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+    user = f"当前用户问题：{nl_query}\n请直接返回唯一可执行的 Cypher 查询（不要解释）。"
+    # system 只放静态前缀；上一轮上下文作为 user 消息放在末尾，不破坏可缓存的前缀
+    messages = [{"role": "system", "content": _BASE_SYSTEM}]
     if prev_ctx:
-        base += f"\n【上一轮上下文】:\n{json.dumps(prev_ctx, ensure_ascii=False)}\n"
-    return base
+        messages.append({"role": "user", "content": _CTX_HEADER + json.dumps(prev_ctx, ensure_ascii=False)})
+    messages.append({"role": "user", "content": user})
+    return messages
+
+def _llm_cache_key(messages: List[Dict[str, str]]) -> str:
+    return hashlib.blake2b(
+        orjson.dumps([OPENAI_MODEL, LLM_TEMPERATURE, messages]), digest_size=16
+    ).hexdigest()
+
+# LLM 缓存在重启之间保留：启动时读回，关闭时整体写盘（先写临时文件再替换）
+@app.on_event("startup")
+def load_llm_cache():
+    try:
+        with open(LLM_CACHE_FILE, "rb") as f:
+            _LLM_CACHE.update(orjson.loads(f.read()))
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        print(f"⚠️ LLM 缓存读取失败: {e}")
+        return
+    while len(_LLM_CACHE) > LLM_CACHE_MAX:
+        _LLM_CACHE.popitem(last=False)
+    print(f"✅ 已加载 {len(_LLM_CACHE)} 条 LLM 缓存")
 
-def llm_to_cypher(nl_query: str, prev_ctx: Optional[Dict[str, Any]]):
+@app.on_event("shutdown")
+def save_llm_cache():
+    tmp = LLM_CACHE_FILE + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(_LLM_CACHE))
+        os.replace(tmp, LLM_CACHE_FILE)
+    except Exception as e:
+        print(f"⚠️ LLM 缓存写盘失败: {e}")
+
+async def llm_to_cypher(nl_query: str, prev_ctx: Optional[Dict[str, Any]]):
+    messages = build_messages(nl_query, prev_ctx)
+    key = _llm_cache_key(messages)
+    if key in _LLM_CACHE:
+        _LLM_CACHE.move_to_end(key)
+        return _LLM_CACHE[key]
     if not llm_ready:
         raise RuntimeError("OpenAI 未就绪")
-    system = build_system_prompt(prev_ctx)
-    user = f"当前用户问题：{nl_query}\n请直接返回唯一可执行的 Cypher 查询（不要解释）。"
-    resp = client.chat.completions.create(
+    resp = await client.chat.completions.create(
         model=OPENAI_MODEL,
-        messages=[{"role": "system", "content": system},
-                  {"role": "user", "content": user}],
-        temperature=0,
+        messages=messages,
+        temperature=LLM_TEMPERATURE,
         timeout=30
     )
     text = resp.choices[0].message.content.strip()
     text = re.sub(r"^```(?:cypher)?", "", text, flags=re.IGNORECASE).strip()
     text = re.sub(r"```$", "", text).strip()
+    _LLM_CACHE[key] = text
+    while len(_LLM_CACHE) > LLM_CACHE_MAX:
+        _LLM_CACHE.popitem(last=False)
     return text
 
+# ========== 语义缓存（同义问法复用 Cypher） ==========
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    resp = await client.embeddings.create(model=OPENAI_EMBED_MODEL, input=texts)
+    return [d.embedding for d in resp.data]
+
+# 问题里的实体/剂量字面值：「X为Y」「中药Y」里的 Y、引号里的内容、带单位的数值
+_RE_Q_VALUE = re.compile(r"(?:为|是)\s*([^\s,，。？?、的]+)")
+_RE_Q_HERB = re.compile(r"中药\s*([^\s,，。？?、的为是]+)")
+_RE_HERB_TAIL = re.compile(r"(的)?(剂量|炮制|方法|和|及).*")
+_RE_Q_QUOTED = re.compile(r"[\"'“‘「『]([^\"'”’」』]+)[\"'”’」』]")
+_RE_Q_NUMBER = re.compile(r"\d+(?:\.\d+)?\s*[a-zA-Z克钱两]*")
+_RE_CYPHER_LITERAL = re.compile(r"'([^'\\]*)'|\"([^\"\\]*)\"")
+# 问题问的是哪类属性：「都有哪些疾病」与「都有哪些证型」只差一个名词，向量可能很近，必须分开
+_Q_TARGETS = ("症状", "舌象", "脉象", "证型", "疾病", "处方", "中药", "剂量", "炮制", "煎服",
+              "案例号", "原始文献", "频次")
+
+def _query_entities(q: str) -> FrozenSet[str]:
+    """语义缓存的 tag：只有实体/剂量与所问属性都相同的问题之间才允许复用 Cypher"""
+    q = _normalize_query(q)
+    found = set(_RE_Q_VALUE.findall(q)) | set(_RE_Q_QUOTED.findall(q)) | set(_RE_Q_NUMBER.findall(q))
+    found |= {_RE_HERB_TAIL.sub("", h) for h in _RE_Q_HERB.findall(q)}
+    found |= {t for t in _Q_TARGETS if t in q}
+    found.discard("")
+    return frozenset(found)
+
+def _cypher_literals(cypher: str) -> List[str]:
+    return [a or b for a, b in _RE_CYPHER_LITERAL.findall(cypher)]
+
+def _literals_in_query(cypher: str, q: str) -> bool:
+    """兜底：缓存 Cypher 里写死的字符串字面值必须都出现在新问题里"""
+    q = _normalize_query(q)
+    return all(lit in q for lit in _cypher_literals(cypher))
+
+async def generate_cypher(nl_query: str, prev_ctx: Optional[Dict[str, Any]]) -> str:
+    """无上下文的问题先查语义缓存（只在实体相同的条目里比相似度），未命中再调用 LLM 并写回缓存"""
+    if SEM_CACHE is None or prev_ctx or _llm_cache_key(build_messages(nl_query, None)) in _LLM_CACHE:
+        return await llm_to_cypher(nl_query, prev_ctx)
+    try:
+        vec = (await embed_texts([nl_query]))[0]
+    except Exception as e:
+        print(f"⚠️ embedding 失败，跳过语义缓存: {e}")
+        return await llm_to_cypher(nl_query, prev_ctx)
+    tag = _query_entities(nl_query)
+    hit = SEM_CACHE.lookup(vec, tag)
+    if hit is not None and _literals_in_query(hit, nl_query):
+        print("🎯 语义缓存命中:", nl_query)
+        return hit
+    cypher = await llm_to_cypher(nl_query, prev_ctx)
+    SEM_CACHE.add(vec, cypher, tag)
+    return cypher
+
+@app.on_event("startup")
+async def seed_semantic_cache():
+    if SEM_CACHE is None:
+        return
+    # 写死了药名/剂量的推荐问题不预置：换一个实体就不能复用
+    pairs = [(i, j) for i, j in _RECOMMENDED_EXAMPLE_PAIRS if not _cypher_literals(SCHEMA["examples"][j])]
+    try:
+        vecs = await embed_texts([RECOMMENDED_QUERIES[i] for i, _ in pairs])
+    except Exception as e:
+        print(f"⚠️ 语义缓存预置失败: {e}")
+        return
+    for (i, j), vec in zip(pairs, vecs):
+        SEM_CACHE.add(vec, SCHEMA["examples"][j], _query_entities(RECOMMENDED_QUERIES[i]), pinned=True)
+    print(f"✅ 语义缓存已预置 {len(SEM_CACHE)} 条")
+
 # ========== 结果格式化（恢复原版 format_answer） ==========
 def format_answer(results: List[Dict[str, Any]]) -> str:
     if not results:
@@ -249,96 +459,136 @@ class CypherResponse(BaseModel):
     session_id: Optional[str] = None
     used_prev_context: bool = False
 
-@app.get("/ask", response_model=CypherResponse)
-def ask(query: str, session_id: str = "default", dryrun: bool = False):
+def cypher_response(query: str, cypher: str, **fields: Any) -> ORJSONResponse:
+    """与 CypherResponse 同形状的响应体，直接序列化，跳过 Pydantic 对每一行结果的校验"""
+    body = {
+        "query": query, "cypher": cypher, "results": [], "answer": None,
+        "note": None, "session_id": None, "used_prev_context": False,
+    }
+    body.update(fields)
+    return ORJSONResponse(body)
+
+# CypherResponse 只用于 OpenAPI 文档
+@app.get("/ask", response_class=ORJSONResponse, responses={200: {"model": CypherResponse}})
+async def ask(query: str, session_id: str = "default", dryrun: bool = False,
+              session: AsyncSession = Depends(get_session)):
     try:
-        prev_ctx = LAST_CONTEXT.get(session_id)
-        cypher = llm_to_cypher(query, prev_ctx)
+        # 推荐问题直接走手写 Cypher，无需调用 LLM
+        prev_ctx = None
+        cypher = FAST_PATH.get(_normalize_query(query))
+        if cypher is None:
+            prev_ctx = get_last_context(session_id)
+            cypher = await generate_cypher(query, prev_ctx)
         if not is_safe_cypher(cypher):
             raise HTTPException(status_code=400, detail=f"生成的 Cypher 非只读：\n{cypher}")
         if dryrun:
-            return CypherResponse(query=query, cypher=cypher, note="dryrun=true")
-        results = run_cypher(cypher)
+            return cypher_response(query, cypher, note="dryrun=true")
+        results = await run_cypher(session, cypher)
         answer = format_answer(results)
-        LAST_CONTEXT[session_id] = {"query": query, "cypher": cypher, "results": results}
-        return CypherResponse(query=query, cypher=cypher, results=results, answer=answer, session_id=session_id)
+        set_last_context(session_id, {
+            "query": query, "cypher": cypher,
+            "results_preview": results[:_CTX_RESULTS_MAX], "result_count": len(results)
+        })
+        return cypher_response(query, cypher, results=results, answer=answer, session_id=session_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查询失败：{type(e).__name__}: {e}")
 
 # ========== JSON 文件管理 ==========
 JSON_DIR = os.path.join(os.path.dirname(__file__), "json_data")
 
+def _read_json(path: str) -> Any:
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+def _write_json(path: str, content: Any) -> None:
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(content, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
 @app.get("/list_json_files")
 def list_json_files():
-    return [os.path.basename(f) for f in glob.glob(os.path.join(JSON_DIR, "*.json"))]
+    # scandir 的 DirEntry 自带文件名和类型，不用 glob 的 fnmatch 和逐个 basename；与 glob 一样跳过隐藏文件
+    with os.scandir(JSON_DIR) as it:
+        return [e.name for e in it if e.name.endswith(".json") and not e.name.startswith(".") and e.is_file()]
 
+# 文件读写放到线程池，不阻塞事件循环
 @app.get("/get_json")
-def get_json(filename: str):
+async def get_json(filename: str):
     path = os.path.join(JSON_DIR, filename)
-    if not os.path.exists(path):
+    try:
+        return await run_in_threadpool(_read_json, path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"{filename} 不存在")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
 
 @app.put("/update_json")
-def update_json(data: dict):
+async def update_json(data: dict):
     filename = data.get("filename")
     content = data.get("content")
     if not filename:
         raise HTTPException(status_code=400, detail="缺少 filename")
     path = os.path.join(JSON_DIR, filename)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(content, f, ensure_ascii=False, indent=2)
+    await run_in_threadpool(_write_json, path, content)
     return {"status": "ok", "message": f"{filename} 已更新"}
 
 # ========== refresh_kg 单病例刷新 ==========
-def run(tx, q, p=None): tx.run(q, p or {})
+# 单病例重建只用一条语句、一次往返：先删旧 Case，再整体写回
+# 用 FOREACH 而不是串联 UNWIND：某个列表为空时 UNWIND 会把整行吞掉，后面的实体全部写不进去
+_REFRESH_CASE_CYPHER = """
+OPTIONAL MATCH (old:Case {case_id:$case.case_id})
+DETACH DELETE old
+WITH count(*) AS deleted
+MERGE (c:Case {case_id:$case.case_id})
+SET c.symptoms=$case.symptoms, c.tongue=$case.tongue, c.pulse=$case.pulse, c.original_text=$case.original_text
+FOREACH (d IN $case.diagnosis |
+  MERGE (dn:Diagnosis {name:d})
+  MERGE (c)-[:HAS_DIAGNOSIS]->(dn))
+FOREACH (z IN $case.zhengxing |
+  MERGE (zn:ZhengXing {name:z})
+  MERGE (c)-[:HAS_ZHENGXING]->(zn))
+FOREACH (p IN $case.prescriptions |
+  MERGE (pr:Prescription {case_id:$case.case_id, idx:p.idx})
+  SET pr.formula=p.formula, pr.method=p.method
+  MERGE (c)-[:HAS_PRESCRIPTION]->(pr)
+  FOREACH (h IN p.herbs |
+    MERGE (herb:Herb {name:h.name})
+    ON CREATE SET herb.first_seen = date()
+    MERGE (pr)-[r:CONTAINS_HERB]->(herb)
+    SET r.dose=h.dose, r.prep=h.prep))
+"""
+
+async def _write_case(tx, cid, v):
+    """一个事务内重建病例：在 Python 里拼好整个 $case 参数（处方带上 idx），一条语句写完"""
+    case = {
+        "case_id": cid,
+        "symptoms": v.get("symptoms", []),
+        "tongue": v.get("tongue", []),
+        "pulse": v.get("pulse", []),
+        "original_text": v.get("original_text"),
+        "diagnosis": v.get("diagnosis", []),
+        "zhengxing": v.get("zhengxing", []),
+        "prescriptions": [
+            {"idx": i, "formula": p.get("formula") or "（未明示方名/加减方）", "method": p.get("method"),
+             "herbs": [{"name": h.get("name"), "dose": h.get("dose"), "prep": h.get("prep")} for h in p.get("herbs", [])]}
+            for i, p in enumerate(v.get("prescriptions", []))
+        ],
+    }
+    await tx.run(_REFRESH_CASE_CYPHER, {"case": case})
 
 @app.post("/refresh_kg")
-def refresh_kg(payload: dict):
+async def refresh_kg(payload: dict, session: AsyncSession = Depends(get_session)):
     filename = payload.get("filename")
     if not filename:
         raise HTTPException(status_code=400, detail="缺少 filename 参数")
     path = os.path.join(JSON_DIR, filename)
-    if not os.path.exists(path):
+    # async 接口里不能直接做阻塞的文件读取，存在性也由线程池里的读取来判断
+    try:
+        v = await run_in_threadpool(_read_json, path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"文件 {filename} 不存在")
-    with open(path, "r", encoding="utf-8") as f:
-        v = json.load(f)
     cid = v.get("case_id")
     if not cid:
         raise HTTPException(status_code=400, detail="JSON 文件缺少 case_id")
 
-    with driver.session() as s:
-        s.execute_write(run, "MATCH (c:Case {case_id:$cid}) DETACH DELETE c", {"cid": cid})
-        s.execute_write(run, """
-        MERGE (c:Case {case_id:$case_id})
-        SET c.symptoms=$symptoms, c.tongue=$tongue, c.pulse=$pulse, c.original_text=$original_text
-        """, {
-            "case_id": cid,
-            "symptoms": v.get("symptoms", []),
-            "tongue": v.get("tongue", []),
-            "pulse": v.get("pulse", []),
-            "original_text": v.get("original_text")
-        })
-        for d in v.get("diagnosis", []):
-            s.execute_write(run, "MERGE (d:Diagnosis {name:$d}) WITH d MATCH (c:Case {case_id:$cid}) MERGE (c)-[:HAS_DIAGNOSIS]->(d)", {"cid": cid, "d": d})
-        for z in v.get("zhengxing", []):
-            s.execute_write(run, "MERGE (z:ZhengXing {name:$z}) WITH z MATCH (c:Case {case_id:$cid}) MERGE (c)-[:HAS_ZHENGXING]->(z)", {"cid": cid, "z": z})
-        for i, p in enumerate(v.get("prescriptions", [])):
-            s.execute_write(run, """
-            MERGE (pr:Prescription {case_id:$cid, idx:$idx})
-            SET pr.formula=coalesce($formula, "（未明示方名/加减方）"), pr.method=$method
-            WITH pr MATCH (c:Case {case_id:$cid})
-            MERGE (c)-[:HAS_PRESCRIPTION]->(pr)
-            """, {"cid": cid, "idx": i, "formula": p.get("formula"), "method": p.get("method")})
-            for h in p.get("herbs", []):
-                s.execute_write(run, """
-                MERGE (herb:Herb {name:$name})
-                ON CREATE SET herb.first_seen = date()
-                WITH herb MATCH (pr:Prescription {case_id:$cid, idx:$idx})
-                MERGE (pr)-[r:CONTAINS_HERB]->(herb)
-                SET r.dose=$dose, r.prep=$prep
-                """, {"name": h.get("name"), "dose": h.get("dose"), "prep": h.get("prep"), "cid": cid, "idx": i})
+    await session.execute_write(_write_case, cid, v)
     return {"status": "ok", "message": f"✅ 病例 {cid} 已重新导入知识图谱"}
 
 # ========== 健康检查 ==========
@@ -347,5 +597,5 @@ def health():
     return {"status": "ok", "neo4j_ready": neo4j_ready, "llm_ready": llm_ready, "model": OPENAI_MODEL}
 
 @app.on_event("shutdown")
-def close_driver():
-    driver.close()
+async def close_driver():
+    await driver.close()
@@ -1,22 +1,35 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 from docx import Document
 
 input_folder = "raw_data"
 output_folder = "raw_data_txt"
-os.makedirs(output_folder, exist_ok=True)
-
-for filename in os.listdir(input_folder):
-    if filename.lower().endswith((".docx", ".doc")):
-        input_path = os.path.join(input_folder, filename)
-        output_path = os.path.join(output_folder, os.path.splitext(filename)[0] + ".txt")
-
-        try:
-            doc = Document(input_path)
-            text = "\n".join([para.text for para in doc.paragraphs])
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(text)
-            print(f"✅ Converted: {filename} -> {output_path}")
-        except Exception as e:
-            print(f"❌ Failed to convert {filename}: {e}")
-
-print("🎯 All DOCX files converted to UTF-8 TXT successfully.")
+
+
+def convert_one(filename):
+    input_path = os.path.join(input_folder, filename)
+    output_path = os.path.join(output_folder, os.path.splitext(filename)[0] + ".txt")
+
+    try:
+        doc = Document(input_path)
+        # 逐段直接写入文件，不再拼出整篇文本
+        with open(output_path, "w", encoding="utf-8") as f:
+            for i, para in enumerate(doc.paragraphs):
+                if i:
+                    f.write("\n")
+                f.write(para.text)
+        return f"✅ Converted: {filename} -> {output_path}"
+    except Exception as e:
+        return f"❌ Failed to convert {filename}: {e}"
+
+
+if __name__ == "__main__":
+    os.makedirs(output_folder, exist_ok=True)
+    files = [fn for fn in os.listdir(input_folder) if fn.lower().endswith((".docx", ".doc"))]
+
+    # 每个文件一个进程任务，按 CPU 核数并行转换
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for msg in pool.map(convert_one, files):
+            print(msg)
+
+    print("🎯 All DOCX files converted to UTF-8 TXT successfully.")
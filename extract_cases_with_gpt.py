@@ -1,19 +1,21 @@
 import os
-import json
-import re
+import orjson
+import asyncio
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 # ===== 1. 加载 .env 配置 =====
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "16"))
 
 if not OPENAI_API_KEY:
     raise ValueError("❌ 未检测到 OPENAI_API_KEY，请在 .env 文件中添加。")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 限流(429)、超时和 5xx 由 SDK 自带的指数退避重试处理
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=5)
 
 # ===== 2. 路径设置 =====
 INPUT_DIR = "raw_data_txt"
@@ -66,53 +68,66 @@ SYSTEM_PROMPT = """
 """
 
 
-# ===== 4. 遍历病例文件 =====
-for filename in sorted(os.listdir(INPUT_DIR)):
-    if not filename.endswith(".txt"):
-        continue
+# ===== 4. 单个病例处理 =====
+def read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
 
+
+def write_json(path, data):
+    # orjson 直接输出 UTF-8 bytes，中文不转义，缩进与 json.dump(indent=2) 一致
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+
+async def process(sem, filename):
     case_id = os.path.splitext(filename)[0]  # e.g., w001
     input_path = os.path.join(INPUT_DIR, filename)
     output_path = os.path.join(OUTPUT_DIR, f"{case_id}.json")
 
-    with open(input_path, "r", encoding="utf-8") as f:
-        text = f.read().strip()
+    async with sem:
+        # 文件读写放到线程里，不阻塞事件循环
+        text = await asyncio.to_thread(read_text, input_path)
+
+        print(f"🩺 处理 {case_id} ...")
+
+        # ===== 5. 调用 GPT 模型 =====
+        try:
+            completion = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": f"病例号：{case_id}\n{text}"}
+                ],
+                # JSON mode：模型只会返回一个合法 JSON 对象，无需再从文本里抠
+                response_format={"type": "json_object"}
+            )
 
-    print(f"🩺 处理 {case_id} ...")
+            # ===== 6. 解析 JSON 内容 =====
+            data = orjson.loads(completion.choices[0].message.content)
 
-    # ===== 5. 调用 GPT 模型 =====
-    try:
-        completion = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": f"病例号：{case_id}\n{text}"}
-            ]
-        )
+            # ===== 7. 自动校验 & 补全 case_id =====
+            if isinstance(data, dict):
+                data["case_id"] = case_id
+                if "original_text" not in data or not data["original_text"]:
+                    data["original_text"] = text
 
-        content = completion.choices[0].message.content.strip()
+            # ===== 8. 保存结果 =====
+            await asyncio.to_thread(write_json, output_path, data)
 
-        # ===== 6. 提取 JSON 内容 =====
-        match = re.search(r"\{[\s\S]+\}", content)
-        if match:
-            json_str = match.group(0)
-            data = json.loads(json_str)
-        else:
-            data = {"error": "未检测到 JSON 输出", "raw_output": content}
+            print(f"✅ 已保存 {output_path}")
 
-        # ===== 7. 自动校验 & 补全 case_id =====
-        if isinstance(data, dict):
-            data["case_id"] = case_id
-            if "original_text" not in data or not data["original_text"]:
-                data["original_text"] = text
+        except Exception as e:
+            print(f"❌ {case_id} 处理失败: {e}")
 
-        # ===== 8. 保存结果 =====
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
 
-        print(f"✅ 已保存 {output_path}")
+# ===== 9. 并发处理全部病例 =====
+async def main():
+    sem = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+    files = [fn for fn in sorted(os.listdir(INPUT_DIR)) if fn.endswith(".txt")]
+    await asyncio.gather(*[process(sem, fn) for fn in files])
+    print("🎯 所有病例处理完成！")
 
-    except Exception as e:
-        print(f"❌ {case_id} 处理失败: {e}")
 
-print("🎯 所有病例处理完成！")
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -8,8 +8,12 @@
 - Herb 关系属性保存于 r.dose / r.prep，不再写入 Herb 节点属性。
 """
 
-import json, glob, os
-from neo4j import GraphDatabase
+import asyncio, os, random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import orjson
+from neo4j import AsyncGraphDatabase
+from neo4j.exceptions import TransientError
 from dotenv import load_dotenv
 
 # ======== 加载 .env ========
@@ -18,123 +22,424 @@ load_dotenv()
 URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 AUTH = (os.getenv("NEO4J_USER", "neo4j"), os.getenv("NEO4J_PASS", "test12345"))
 
-driver = GraphDatabase.driver(URI, auth=AUTH)
+driver = AsyncGraphDatabase.driver(
+    URI,
+    auth=AUTH,
+    max_connection_pool_size=int(os.getenv("NEO4J_POOL_SIZE", "50")),
+    # 批量导入时连接被长事务占用更久，获取超时放宽
+    connection_acquisition_timeout=float(os.getenv("NEO4J_ACQ_TIMEOUT", "120")),
+    connection_timeout=10,
+    keep_alive=True,
+    # 一次性导入不需要 execute_write 的指数退避重试
+    max_transaction_retry_time=0,
+)
 
-# ======== 执行函数 ========
-def run(tx, q, p=None):
-    tx.run(q, p or {})
+# 每个事务最多写入的行数，避免大批量时撑爆 Neo4j 堆和事务日志
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "1000"))
+# 同时在途的写事务数（= 复用的 session 数），应不超过 NEO4J_POOL_SIZE
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "8"))
+# 记录上次成功导入时各文件的 mtime（按 NEO4J_URI 分开记录），重复运行时跳过没改动的文件
+IMPORT_STATE_FILE = os.getenv("IMPORT_STATE_FILE", ".import_state.json")
+# IMPORT_FULL=1：忽略导入记录，全部重新导入
+IMPORT_FULL = os.getenv("IMPORT_FULL", "0") == "1"
+# 并发批次往同一节点上挂关系偶尔会死锁（TransientError），只对这种情况重试；
+# 与之冲突的批次往往还在跑，立即重试大概率再次死锁，所以每次重试前做带随机抖动的指数退避
+IMPORT_RETRIES = 3
+IMPORT_RETRY_BASE = 0.1  # 秒；第 n 次重试前等待 uniform(0, IMPORT_RETRY_BASE * 2**n)
 
+# ======== 数据整理 ========
+# 行数最多的几类关系按列存储（字段名 → 列表），不为每一行分配一个 dict；
+# 发送时每列各切一段，Cypher 里按下标取值
+COLUMNS = {
+    "diagnoses": ("cid", "name"),
+    "zhengxings": ("cid", "name"),
+    "herbs": ("cid", "idx", "name", "dose", "prep"),
+}
 
-with driver.session() as s:
-    # ====== 唯一约束 ======
-    s.execute_write(run, """
+
+def new_rows():
+    return {key: {f: [] for f in COLUMNS[key]} if key in COLUMNS else [] for key in UNWIND_QUERIES}
+
+
+def add_leaves(rows, seen, key, names):
+    """同名 Diagnosis/ZhengXing/Herb 只 MERGE 一次：只有第一次出现的名字进入待写列表，关系语句里只需 MATCH"""
+    known = seen.setdefault(key, set())
+    for name in names:
+        if name not in known:
+            known.add(name)
+            rows[key].append(name)
+
+
+def collect_rows(v, rows, seen):
+    """把单个 JSON 病例拆成扁平行 / 列，追加到 rows 对应的位置"""
+    cid = v["case_id"]
+    rows["cases"].append({
+        "case_id": cid,
+        "symptoms": v.get("symptoms", []),
+        "tongue": v.get("tongue", []),
+        "pulse": v.get("pulse", []),
+        "original_text": v.get("original_text")
+    })
+    for key, field in (("diagnoses", "diagnosis"), ("zhengxings", "zhengxing")):
+        names = v.get(field, [])
+        rows[key]["cid"].extend([cid] * len(names))
+        rows[key]["name"].extend(names)
+    add_leaves(rows, seen, "diagnosis_nodes", v.get("diagnosis", []))
+    add_leaves(rows, seen, "zhengxing_nodes", v.get("zhengxing", []))
+    herbs = rows["herbs"]
+    for i, p in enumerate(v.get("prescriptions", [])):
+        rows["prescriptions"].append({
+            "cid": cid,
+            "idx": i,
+            "formula": p.get("formula") or "（未明示方名/加减方）",
+            "method": p.get("method")
+        })
+        for h in p.get("herbs", []):
+            herbs["cid"].append(cid)
+            herbs["idx"].append(i)
+            herbs["name"].append(h.get("name"))
+            herbs["dose"].append(h.get("dose"))
+            herbs["prep"].append(h.get("prep"))
+        add_leaves(rows, seen, "herb_nodes", [h.get("name") for h in p.get("herbs", [])])
+
+
+# ======== 批量写入语句（每类一条 UNWIND） ========
+UNWIND_QUERIES = {
+    # ---- Case 节点 ----
+    "cases": """
+    UNWIND $rows AS r
+    MERGE (c:Case {case_id:r.case_id})
+    SET c.symptoms=r.symptoms,
+        c.tongue=r.tongue,
+        c.pulse=r.pulse,
+        c.original_text=r.original_text
+    """,
+    # ---- 去重后的叶子节点（每个名字一行） ----
+    "diagnosis_nodes": """
+    UNWIND $rows AS name
+    MERGE (:Diagnosis {name:name})
+    """,
+    "zhengxing_nodes": """
+    UNWIND $rows AS name
+    MERGE (:ZhengXing {name:name})
+    """,
+    "herb_nodes": """
+    UNWIND $rows AS name
+    MERGE (herb:Herb {name:name})
+    ON CREATE SET herb.first_seen = date()
+    """,
+    # ---- Diagnosis 关系 ----
+    "diagnoses": """
+    UNWIND range(0, size($cid) - 1) AS k
+    MATCH (c:Case {case_id:$cid[k]})
+    MATCH (d:Diagnosis {name:$name[k]})
+    MERGE (c)-[:HAS_DIAGNOSIS]->(d)
+    """,
+    # ---- ZhengXing 关系 ----
+    "zhengxings": """
+    UNWIND range(0, size($cid) - 1) AS k
+    MATCH (c:Case {case_id:$cid[k]})
+    MATCH (z:ZhengXing {name:$name[k]})
+    MERGE (c)-[:HAS_ZHENGXING]->(z)
+    """,
+    # ---- Prescription 节点 & 关系 ----
+    "prescriptions": """
+    UNWIND $rows AS r
+    MATCH (c:Case {case_id:r.cid})
+    MERGE (pr:Prescription {case_id:r.cid, idx:r.idx})
+    SET pr.formula=r.formula,
+        pr.method=r.method
+    MERGE (c)-[:HAS_PRESCRIPTION]->(pr)
+    """,
+    # ---- CONTAINS_HERB 关系 ----
+    "herbs": """
+    UNWIND range(0, size($cid) - 1) AS k
+    MATCH (pr:Prescription {case_id:$cid[k], idx:$idx[k]})
+    MATCH (herb:Herb {name:$name[k]})
+    MERGE (pr)-[x:CONTAINS_HERB]->(herb)
+    SET x.dose=$dose[k], x.prep=$prep[k]
+    """,
+}
+
+# ======== 导入记录校验 ========
+# 每个文件对应一个 Case；库里的 Case 比记录少，说明库被清空或换了实例，记录不可信
+CASE_COUNT_QUERY = "MATCH (c:Case) RETURN count(c) AS n"
+
+# ======== 导入后统计 ========
+COUNT_QUERY = """
+RETURN
+  count { MATCH (c:Case) } AS case_count,
+  count { MATCH (d:Diagnosis) } AS diag_count,
+  count { MATCH (z:ZhengXing) } AS zhengxing_count,
+  count { MATCH (p:Prescription) } AS pres_count,
+  count { MATCH (h:Herb) } AS herb_count
+"""
+
+# ======== 约束与索引 ========
+SCHEMA_STATEMENTS = (
+    # ---- 唯一约束 ----
+    """
     CREATE CONSTRAINT case_id_unique IF NOT EXISTS
     FOR (c:Case) REQUIRE c.case_id IS UNIQUE
-    """)
-    s.execute_write(run, """
+    """,
+    """
     CREATE CONSTRAINT diag_name_unique IF NOT EXISTS
     FOR (d:Diagnosis) REQUIRE d.name IS UNIQUE
-    """)
-    s.execute_write(run, """
+    """,
+    """
     CREATE CONSTRAINT zhengxing_name_unique IF NOT EXISTS
     FOR (z:ZhengXing) REQUIRE z.name IS UNIQUE
-    """)
-    s.execute_write(run, """
+    """,
+    """
     CREATE CONSTRAINT herb_name_unique IF NOT EXISTS
     FOR (h:Herb) REQUIRE h.name IS UNIQUE
-    """)
+    """,
+    # Prescription 按 (case_id, idx) MERGE/MATCH，复合唯一约束自带索引，走索引查找而非全标签扫描
+    """
+    CREATE CONSTRAINT prescription_cid_idx IF NOT EXISTS
+    FOR (p:Prescription) REQUIRE (p.case_id, p.idx) IS UNIQUE
+    """,
+    # ---- 查询用索引 ----
+    # 剂量过滤（WHERE r.dose = '450g'）
+    """
+    CREATE INDEX herb_dose_idx IF NOT EXISTS
+    FOR ()-[r:CONTAINS_HERB]-() ON (r.dose)
+    """,
+    # 煎服方法统计
+    """
+    CREATE INDEX pres_method_idx IF NOT EXISTS
+    FOR (p:Prescription) ON (p.method)
+    """,
+    # 原文关键词检索：db.index.fulltext.queryNodes('case_text_ft', '"盗汗"')
+    # 默认分词器把中文拆成单字再 OR（盗汗 会命中 自汗/无汗），改用 cjk 双字切分，并用短语查询
+    """
+    CREATE FULLTEXT INDEX case_text_ft IF NOT EXISTS
+    FOR (c:Case) ON EACH [c.original_text]
+    OPTIONS {indexConfig: {`fulltext.analyzer`: 'cjk'}}
+    """,
+)
+
+# 分阶段并发：同一阶段内的批次互不依赖，阶段之间要等上一阶段全部提交
+# 先 Case 与去重后的叶子节点，再挂在 Case 上的关系/处方，CONTAINS_HERB 最后（依赖 Prescription）
+STAGES = (
+    ("cases", "diagnosis_nodes", "zhengxing_nodes", "herb_nodes"),
+    ("diagnoses", "zhengxings", "prescriptions"),
+    ("herbs",),
+)
+
+
+def row_count(data):
+    """行数：行列表取长度，列式数据（各列等长）取任一列的长度"""
+    if isinstance(data, dict):
+        return len(next(iter(data.values())))
+    return len(data)
+
+
+def row_slice(data, start, stop=None):
+    """切出第 start..stop 行，两种形态都保持原形态"""
+    if isinstance(data, dict):
+        return {f: col[start:stop] for f, col in data.items()}
+    return data[start:stop]
+
+
+def chunks(data, n=BATCH_SIZE):
+    """按 n 行切批，产出 tx.run 的参数：行列表 → {"rows": 一段}，列式数据 → 每列各切一段"""
+    for i in range(0, row_count(data), n):
+        part = row_slice(data, i, i + n)
+        yield part if isinstance(data, dict) else {"rows": part}
+
+
+# ======== session 复用 ========
+# 固定 IMPORT_WORKERS 个 session 轮流借用，整个导入过程复用，结束时统一关闭；
+# 一个 session 同一时刻只能跑一个事务，空闲队列同时起到并发上限的作用
+_sessions = []
+_idle = None
+
+
+def open_sessions(n=IMPORT_WORKERS):
+    global _idle
+    _idle = asyncio.Queue()
+    for _ in range(n):
+        s = driver.session()
+        _sessions.append(s)
+        _idle.put_nowait(s)
+
+
+async def close_sessions():
+    for s in _sessions:
+        await s.close()
+    _sessions.clear()
+
+
+@asynccontextmanager
+async def borrow_session():
+    s = await _idle.get()
+    try:
+        yield s
+    finally:
+        _idle.put_nowait(s)
+
+
+async def write_chunk(q, params):
+    """每个批次一个显式事务"""
+    async with borrow_session() as s:
+        for attempt in range(IMPORT_RETRIES):
+            try:
+                async with await s.begin_transaction() as tx:
+                    await tx.run(q, params)
+                    await tx.commit()
+                return
+            except TransientError:
+                if attempt == IMPORT_RETRIES - 1:
+                    raise
+                await asyncio.sleep(random.uniform(0, IMPORT_RETRY_BASE * 2 ** attempt))
+
+
+async def create_schema(s):
+    """schema 语句自动提交，直接 run 即可，不需要 execute_write 的重试包装"""
+    for stmt in SCHEMA_STATEMENTS:
+        await (await s.run(stmt)).consume()
+
+
+def submit_ready(rows, keys, final=False):
+    """把攒满 BATCH_SIZE 的整批行作为写入任务启动，不足一批的留到下次；final=True 时连尾巴一起提交"""
+    tasks = []
+    for key in keys:
+        data = rows[key]
+        size = row_count(data)
+        cut = size if final else size - size % BATCH_SIZE
+        if cut:
+            tasks += [asyncio.create_task(write_chunk(UNWIND_QUERIES[key], params))
+                      for params in chunks(row_slice(data, 0, cut))]
+            rows[key] = row_slice(data, cut)
+    return tasks
+
+
+async def cancel_all(tasks):
+    """取消尚未完成的写入任务并等它们退出（事务回滚、会话归还），之后才能安全关闭会话"""
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def wait_all(tasks):
+    """屏障：等本阶段全部完成；任一批失败则先取消其余批次，再抛出异常"""
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        await cancel_all(tasks)
+        raise
+
+
+def load_state():
+    """整个记录文件：{NEO4J_URI: {文件路径: mtime_ns}}"""
+    try:
+        with open(IMPORT_STATE_FILE, "rb") as f:
+            data = orjson.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"⚠️ 导入记录读取失败，全部重新导入: {e}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_state(all_state):
+    tmp = IMPORT_STATE_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(all_state))
+    os.replace(tmp, IMPORT_STATE_FILE)
+
+
+async def trusted_state(all_state):
+    """取出当前 NEO4J_URI 的导入记录；IMPORT_FULL=1 或库里 Case 数对不上时返回空，即全部重新导入"""
+    state = all_state.get(URI)
+    if IMPORT_FULL or not isinstance(state, dict) or not state:
+        return {}
+    async with borrow_session() as s:
+        n = (await (await s.run(CASE_COUNT_QUERY)).single())["n"]
+    if n < len(state):
+        print(f"⚠️ 库里只有 {n} 个 Case，少于导入记录里的 {len(state)} 个文件，全部重新导入")
+        return {}
+    return state
+
+
+def load_case(path):
+    """读取并解析单个病例 JSON"""
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def load_cases(paths):
+    """进程池任务：一次解析一组文件，摊薄进程间通信开销"""
+    return [load_case(path) for path in paths]
+
+
+async def main():
+    open_sessions()
+    try:
+        await run_import()
+    finally:
+        await close_sessions()
+        await driver.close()
+
+
+async def run_import():
+    async with borrow_session() as s:
+        await create_schema(s)
 
     # ====== 导入 json_data/ 文件夹下的 JSON ======
-    files = sorted(glob.glob(os.path.join("json_data", "f*.json")))
-    print(f"🔍 找到 {len(files)} 个病例文件。")
-
-    for path in files:
-        with open(path, "r", encoding="utf-8") as f:
-            v = json.load(f)
-
-        cid = v["case_id"]
-        print(f"➡ 导入 {cid} ({os.path.basename(path)}) ...")
-
-        # ---- Case 节点 ----
-        s.execute_write(run, """
-        MERGE (c:Case {case_id:$case_id})
-        SET c.symptoms=$symptoms,
-            c.tongue=$tongue,
-            c.pulse=$pulse,
-            c.original_text=$original_text
-        """, {
-            "case_id": cid,
-            "symptoms": v.get("symptoms", []),
-            "tongue": v.get("tongue", []),
-            "pulse": v.get("pulse", []),
-            "original_text": v.get("original_text")
-        })
+    # scandir 一次遍历拿到文件名和 stat，不用 glob 再逐个 stat
+    with os.scandir("json_data") as it:
+        mtimes = {e.path: e.stat().st_mtime_ns for e in it
+                  if e.name.startswith("f") and e.name.endswith(".json") and e.is_file()}
+    files = sorted(mtimes)
+    all_state = load_state()
+    state = await trusted_state(all_state)
+    todo = [path for path in files if state.get(path) != mtimes[path]]
+    print(f"🔍 找到 {len(files)} 个病例文件，其中 {len(todo)} 个新增或有改动。")
+
+    # 每 BATCH_SIZE 行一个事务，同一阶段的批次并发提交
+    rows, seen = new_rows(), {}
+    # 流水线：子进程读文件 + 解析（每 32 个文件一组），事件循环整理成行，
+    # 第一阶段（Case 与去重后的叶子节点）不依赖其它数据，攒满一批就边解析边写入
+    loop = asyncio.get_running_loop()
+    first = []
+    try:
+        with ProcessPoolExecutor() as ex:
+            groups = [todo[i:i + 32] for i in range(0, len(todo), 32)]
+            parsed = [loop.run_in_executor(ex, load_cases, g) for g in groups]
+            for paths, fut in zip(groups, parsed):
+                for path, v in zip(paths, await fut):
+                    print(f"➡ 读取 {v['case_id']} ({os.path.basename(path)}) ...")
+                    collect_rows(v, rows, seen)
+                first += submit_ready(rows, STAGES[0])
+        first += submit_ready(rows, STAGES[0], final=True)
+    except BaseException:
+        # 解析失败：已启动的第一阶段写入要先取消并等其退出，否则 main() 会在事务未结束时关闭会话
+        await cancel_all(first)
+        raise
+    await wait_all(first)
+
+    for stage in STAGES[1:]:
+        await wait_all([asyncio.create_task(write_chunk(UNWIND_QUERIES[key], params))
+                        for key in stage for params in chunks(rows[key])])
 
-        # ---- Diagnosis 节点 & 关系 ----
-        for dname in v.get("diagnosis", []):
-            s.execute_write(run, """
-            MERGE (d:Diagnosis {name:$dname})
-            WITH d
-            MATCH (c:Case {case_id:$cid})
-            MERGE (c)-[:HAS_DIAGNOSIS]->(d)
-            """, {"cid": cid, "dname": dname})
-
-        # ---- ZhengXing 节点 & 关系 ----
-        for zname in v.get("zhengxing", []):
-            s.execute_write(run, """
-            MERGE (z:ZhengXing {name:$zname})
-            WITH z
-            MATCH (c:Case {case_id:$cid})
-            MERGE (c)-[:HAS_ZHENGXING]->(z)
-            """, {"cid": cid, "zname": zname})
-
-        # ---- Prescriptions & Herbs ----
-        for i, p in enumerate(v.get("prescriptions", [])):
-            s.execute_write(run, """
-            MERGE (pr:Prescription {case_id:$cid, idx:$idx})
-            SET pr.formula=coalesce($formula, "（未明示方名/加减方）"),
-                pr.method=$method
-            WITH pr
-            MATCH (c:Case {case_id:$cid})
-            MERGE (c)-[:HAS_PRESCRIPTION]->(pr)
-            """, {
-                "cid": cid,
-                "idx": i,
-                "formula": p.get("formula"),
-                "method": p.get("method")
-            })
-
-            for h in p.get("herbs", []):
-                s.execute_write(run, """
-                MERGE (herb:Herb {name:$name})
-                ON CREATE SET herb.first_seen = date()
-                WITH herb
-                MATCH (pr:Prescription {case_id:$cid, idx:$idx})
-                MERGE (pr)-[r:CONTAINS_HERB]->(herb)
-                SET r.dose=$dose, r.prep=$prep
-                """, {
-                    "name": h.get("name"),
-                    "dose": h.get("dose"),
-                    "prep": h.get("prep"),
-                    "cid": cid,
-                    "idx": i
-                })
-
-print("✅ 所有病例导入完成。")
-
-# ====== 导入完成后，简单统计 ======
-with driver.session() as s:
+    # 全部写入成功后才记录，中途失败下次会重新导入这些文件
+    all_state[URI] = mtimes
+    save_state(all_state)
+    print("✅ 所有病例导入完成。")
+
+    # ====== 导入完成后，简单统计 ======
     print("\n📊 节点数量:")
-    res = s.run("""
-    RETURN
-      count { MATCH (c:Case) } AS case_count,
-      count { MATCH (d:Diagnosis) } AS diag_count,
-      count { MATCH (z:ZhengXing) } AS zhengxing_count,
-      count { MATCH (p:Prescription) } AS pres_count,
-      count { MATCH (h:Herb) } AS herb_count
-    """).single()
+    async with borrow_session() as s:
+        res = await (await s.run(COUNT_QUERY)).single()
     print(f"  Case: {res['case_count']}")
     print(f"  Diagnosis: {res['diag_count']}")
     print(f"  ZhengXing: {res['zhengxing_count']}")
     print(f"  Prescription: {res['pres_count']}")
     print(f"  Herb: {res['herb_count']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -12,18 +12,23 @@ DROP CONSTRAINT case_id_unique IF EXISTS;
 DROP CONSTRAINT diag_name_unique IF EXISTS;
 DROP CONSTRAINT zhengxing_name_unique IF EXISTS;
 DROP CONSTRAINT herb_name_unique IF EXISTS;
+DROP CONSTRAINT prescription_cid_idx IF EXISTS;
 
 DROP INDEX case_id IF EXISTS;
 DROP INDEX diag_name IF EXISTS;
 DROP INDEX zhengxing_name IF EXISTS;
 DROP INDEX herb_name IF EXISTS;
+DROP INDEX herb_dose_idx IF EXISTS;
+DROP INDEX pres_method_idx IF EXISTS;
+DROP INDEX case_text_ft IF EXISTS;
 
 MATCH (n) DETACH DELETE n;
 "
 echo "✅ 数据已清空"
 
 echo "🚀 Step 2: 重新导入 f*** JSON 数据..."
-python3 import_cases.py
+# 库已清空，忽略上次的导入记录，全部重新导入
+IMPORT_FULL=1 python3 import_cases.py
 echo "✅ 数据重新导入完成"
 
 echo "🚀 Step 3: 验证节点数量..."
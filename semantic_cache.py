@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+语义缓存：自然语言问题的 embedding → 已生成的 Cypher
+同义改写的问题（余弦相似度 ≥ 阈值）直接复用 Cypher，跳过一次 LLM 调用
+每条缓存带一个 tag（问题里的实体/剂量等字面值），只在 tag 完全相同的条目之间比较相似度，
+避免"中药为甘草…"命中"中药为杏仁…"的缓存、拿回写死了另一味药的 Cypher
+"""
+
+import time
+from typing import Hashable, List, Optional, Sequence
+
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(self, threshold: float = 0.92, ttl: float = 3600.0, max_size: int = 1024):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        # (N, d) 行向量均已 L2 归一化，点积即余弦相似度
+        self._mat: Optional[np.ndarray] = None
+        self._cyphers: List[str] = []
+        self._tags: List[Hashable] = []
+        # 写入时间；预置条目记为 inf，永不过期也不会被淘汰
+        self._ts = np.empty(0, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self._cyphers)
+
+    @staticmethod
+    def _normalize(vec: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n > 0 else v
+
+    def _keep(self, mask: np.ndarray) -> None:
+        idx = np.flatnonzero(mask)
+        self._mat = self._mat[idx]
+        self._ts = self._ts[idx]
+        self._cyphers = [self._cyphers[i] for i in idx]
+        self._tags = [self._tags[i] for i in idx]
+
+    def _expire(self, now: float) -> None:
+        if not self._cyphers:
+            return
+        alive = (now - self._ts) < self.ttl
+        if not alive.all():
+            self._keep(alive)
+
+    def lookup(self, vec: Sequence[float], tag: Hashable = None) -> Optional[str]:
+        self._expire(time.monotonic())
+        same = np.fromiter((t == tag for t in self._tags), dtype=bool, count=len(self._tags))
+        if not same.any():
+            return None
+        scores = np.where(same, self._mat @ self._normalize(vec), -np.inf)
+        i = int(np.argmax(scores))
+        return self._cyphers[i] if scores[i] >= self.threshold else None
+
+    def add(self, vec: Sequence[float], cypher: str, tag: Hashable = None, pinned: bool = False) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        row = self._normalize(vec)[None, :]
+        self._mat = row if self._mat is None or not self._cyphers else np.vstack([self._mat, row])
+        self._ts = np.append(self._ts, np.inf if pinned else now)
+        self._cyphers.append(cypher)
+        self._tags.append(tag)
+        overflow = len(self._cyphers) - self.max_size
+        if overflow > 0:
+            # 淘汰最早写入的条目
+            mask = np.ones(len(self._cyphers), dtype=bool)
+            mask[np.argsort(self._ts, kind="stable")[:overflow]] = False
+            self._keep(mask)
+
+    def clear(self) -> None:
+        """清空运行期写入的条目，预置条目保留"""
+        if self._cyphers:
+            self._keep(np.isinf(self._ts))